@@ -1,89 +1,228 @@
 # agent_logic.py
-import requests
+import aiohttp
+import logging
+import threading
+import asyncio
 import json
+import hashlib
 import streamlit as st
 from datetime import datetime
 from pathlib import Path
 from config import OLLAMA_SYSTEM_PROMPT, GEMINI_ROUTING_PROMPT, LOCATION_NAME, GEMINI_EVENT_PROMPT
-from utils import get_weather_info, track_gemini_usage, geocode_location, get_walking_route
+from utils import get_weather_info, track_gemini_usage, get_walking_route, get_http_session
+from utils import NOMINATIM_HEADERS, geocode_location_async, json_loads, json_dumps_bytes, load_json_file
+from utils import get_cached_geocode, set_cached_geocode, parse_event_list
+from utils import route_cache_key, get_cached_route, set_cached_route
 import time
+import os
+import random
+import numpy as np
 
-try:
-    import google.generativeai as genai
-    GEMINI_AVAILABLE = True
-except ImportError:
-    GEMINI_AVAILABLE = False
+# google.generativeai pulls in grpc and is slow to import, so it is loaded
+# on the first Gemini call rather than when the app starts
+genai = None
+ResourceExhausted = None
+_gemini_import = {"tried": False}
+
+def gemini_available():
+    """Import google.generativeai on first use; False if it is not installed"""
+    global genai, ResourceExhausted
+    if not _gemini_import["tried"]:
+        _gemini_import["tried"] = True
+        try:
+            import google.generativeai as genai
+            from google.api_core.exceptions import ResourceExhausted
+        except ImportError:
+            genai = None
+    return genai is not None
 
 EVENTS_FILE = Path("events.json")
+GEMINI_MODEL = 'gemini-2.0-flash-exp'
+OLLAMA_HOST = "http://localhost:11434"
+# (connect, read) timeouts. A non-streamed reply arrives all at once, so its
+# read budget covers the whole generation; when streaming, the read timeout
+# is the longest allowed gap between lines (including a cold model load).
+OLLAMA_TIMEOUT = (2, 60)
+OLLAMA_STREAM_TIMEOUT = (2, 30)
+GEMINI_CONCURRENCY = int(os.getenv("GEMINI_CONCURRENCY", "4"))
+GEMINI_STREAM = os.getenv("GEMINI_STREAM", "1") != "0"  # Set to 0 to wait for the full reply
+
+logger = logging.getLogger(__name__)
+
+# Parsed events.json, keyed by file mtime so reads only re-parse after a change
+_events_cache = {"mtime": None, "data": None}
 
 # --- Ollama Functions ---
 
+@st.cache_data(ttl=10, show_spinner=False)
 def check_ollama():
+    """Probe the local Ollama server (result cached for 10 seconds)"""
     try:
-        response = requests.get("http://localhost:11434", timeout=2)
+        response = get_http_session().head(OLLAMA_HOST, timeout=2)
         return response.status_code == 200
     except:
         return False
 
-def query_ollama(prompt, model="llama3:latest"):
-    """Basic Ollama query without event context"""
-    try:
-        full_prompt = f"{OLLAMA_SYSTEM_PROMPT}\n\nUser: {prompt}"
-        r = requests.post(
-            "http://localhost:11434/api/generate",
-            json={"model": model, "prompt": full_prompt, "stream": False},
-            timeout=60
-        )
-        return r.json().get("response", "No response")
-    except Exception as e:
-        return f"Error: {str(e)}"
+# Static system-prompt prefixes, JSON-escaped once at import. JSON string
+# escaping is per character, so escaped(prefix) + escaped(tail) is exactly
+# the escaped full prompt and only the per-call tail needs encoding.
+_PLAIN_PREFIX = OLLAMA_SYSTEM_PROMPT + "\n\nUser: "
+_EVENTS_PREFIX = OLLAMA_SYSTEM_PROMPT + "\n\n"
+_PLAIN_PREFIX_JSON = json.dumps(_PLAIN_PREFIX)[:-1].encode()
+_EVENTS_PREFIX_JSON = json.dumps(_EVENTS_PREFIX)[:-1].encode()
+_JSON_HEADERS = {"Content-Type": "application/json"}
+# Uncompressed, so each NDJSON line can be handed on as soon as it arrives
+_STREAM_HEADERS = {**_JSON_HEADERS, "Accept-Encoding": "identity"}
+_JSON_DECODER = json.JSONDecoder()
 
-def query_ollama_with_events(prompt, model="llama3:latest"):
-    """Ollama query with real event data injected into context"""
+def build_event_context():
+    """Event list block injected into the Ollama prompt"""
     events = load_events_from_file()
     
-    # Build event context
     if events and events.get("events"):
         event_list = events["events"]
-        event_context = "REAL LOCAL EVENTS (verified from web):\n"
-        for i, evt in enumerate(event_list, 1):
-            event_context += f"{i}. {evt['name']}\n"
-            event_context += f"   Location: {evt.get('location', 'TBD')}\n"
-            event_context += f"   Date/Time: {evt.get('date', '')} {evt.get('time', '')}\n"
-            event_context += f"   Details: {evt.get('description', 'No details')}\n\n"
-        event_context += f"\n(Events last updated: {events.get('last_updated', 'Unknown')})\n"
-    else:
-        event_context = "NO EVENTS LOADED - Ask user to refresh events in sidebar.\n"
-    
-    try:
-        full_prompt = f"""{OLLAMA_SYSTEM_PROMPT}
+        parts = ["REAL LOCAL EVENTS (verified from web):"]
+        parts.extend(
+            f"{i}. {evt['name']}\n"
+            f"   Location: {evt.get('location', 'TBD')}\n"
+            f"   Date/Time: {evt.get('date', '')} {evt.get('time', '')}\n"
+            f"   Details: {evt.get('description', 'No details')}"
+            for i, evt in enumerate(event_list, 1)
+        )
+        parts.append(f"(Events last updated: {events.get('last_updated', 'Unknown')})")
+        return "\n\n".join(parts) + "\n"
+    return "NO EVENTS LOADED - Ask user to refresh events in sidebar.\n"
 
-{event_context}
+def _generate_body(prompt, model, stream, include_events=False):
+    """Encoded /api/generate request body around the pre-escaped system prompt"""
+    if include_events:
+        prefix, tail = _EVENTS_PREFIX_JSON, f"{build_event_context()}\n\nUser: {prompt}"
+    else:
+        prefix, tail = _PLAIN_PREFIX_JSON, prompt
+    return b"".join((
+        b'{"model": ', json.dumps(model).encode(),
+        b', "stream": ', b"true" if stream else b"false",
+        b', "prompt": ', prefix, json.dumps(tail)[1:].encode(), b"}"
+    ))
 
-User: {prompt}"""
-        
-        r = requests.post(
-            "http://localhost:11434/api/generate",
-            json={"model": model, "prompt": full_prompt, "stream": False},
-            timeout=60
+def query_ollama(prompt, model="llama3:latest", *, include_events=False):
+    """Ollama query, optionally with real event data injected into context"""
+    try:
+        r = get_http_session().post(
+            f"{OLLAMA_HOST}/api/generate",
+            data=_generate_body(prompt, model, stream=False, include_events=include_events),
+            headers=_JSON_HEADERS,
+            timeout=OLLAMA_TIMEOUT
         )
-        return r.json().get("response", "No response")
+        r.raise_for_status()
+        return json_loads(r.content).get("response", "No response")
     except Exception as e:
         return f"Error: {str(e)}"
 
+def stream_ollama(prompt, model="llama3:latest", include_events=False):
+    """Yield Ollama response text chunk by chunk as it is generated"""
+    try:
+        with get_http_session().post(
+            f"{OLLAMA_HOST}/api/generate",
+            data=_generate_body(prompt, model, stream=True, include_events=include_events),
+            headers=_STREAM_HEADERS,
+            timeout=OLLAMA_STREAM_TIMEOUT,
+            stream=True
+        ) as r:
+            r.raise_for_status()
+            for line in r.iter_lines():
+                if not line:
+                    continue
+                try:
+                    chunk = json_loads(line)  # orjson takes the raw bytes, no decode
+                except json.JSONDecodeError:
+                    continue
+                yield chunk.get("response", "")
+                if chunk.get("done"):
+                    break
+    except Exception as e:
+        yield f"Error: {str(e)}"
+
+# --- Gemini Client ---
+
+@st.cache_resource(show_spinner=False)
+def get_gemini_model(api_key):
+    """Gemini model built once per API key and reused across reruns"""
+    genai.configure(api_key=api_key)
+    return genai.GenerativeModel(GEMINI_MODEL)
+
+# genai.configure is process-global, so re-point it when a different key
+# shows up even if that key's model is already cached. Only a hash is kept.
+_configured = {"key_hash": None}
+
+def _get_model(api_key):
+    """Configured Gemini model for this API key"""
+    key_hash = hashlib.sha256(api_key.encode()).hexdigest()
+    model = get_gemini_model(api_key)
+    if _configured["key_hash"] != key_hash:
+        genai.configure(api_key=api_key)
+        _configured["key_hash"] = key_hash
+    return model
+
+# Process-wide cap on in-flight Gemini requests, shared by every session, rerun
+# and event loop (each asyncio.run starts a new loop, so an asyncio.Semaphore
+# would only bound a single call)
+_gemini_slots = threading.BoundedSemaphore(GEMINI_CONCURRENCY)
+
+async def _gemini_generate(model, prompt, attempts=3):
+    """generate_content_async bounded by GEMINI_CONCURRENCY, backing off on 429s"""
+    for attempt in range(attempts):
+        # Poll rather than block, so a waiting call doesn't stall its event loop
+        while not _gemini_slots.acquire(blocking=False):
+            await asyncio.sleep(0.05)
+        try:
+            return await model.generate_content_async(prompt)
+        except ResourceExhausted:
+            if attempt == attempts - 1:
+                raise
+        finally:
+            _gemini_slots.release()
+        # Exponential backoff with jitter, without holding a slot
+        await asyncio.sleep(2 ** attempt + random.random())
+
+def _gemini_stream(model, prompt, attempts=3):
+    """
+    Streaming generate_content under the same slots and 429 backoff as
+    _gemini_generate. Yields text chunks; returns the drained response.
+    The slot is held until the stream ends, since the request is in flight until then.
+    """
+    for attempt in range(attempts):
+        _gemini_slots.acquire()
+        try:
+            try:
+                response = model.generate_content(prompt, stream=True)
+                chunks = iter(response)
+                first = next(chunks, None)  # A 429 surfaces by the first chunk
+            except ResourceExhausted:
+                if attempt == attempts - 1:
+                    raise
+            else:
+                if first is not None:
+                    yield first.text
+                for chunk in chunks:
+                    yield chunk.text
+                return response
+        finally:
+            _gemini_slots.release()
+        time.sleep(2 ** attempt + random.random())
+
 # --- Event Management (Gemini) ---
 
-def fetch_real_events(location, api_key, num_events=5):
+async def fetch_real_events_async(location, api_key, num_events=5):
     """Use Gemini to fetch real local events from the web"""
-    if not GEMINI_AVAILABLE:
+    if not gemini_available():
         return {"error": "Gemini not available"}
     
     if not api_key:
         return {"error": "No API key provided"}
     
     try:
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('gemini-2.0-flash-exp')
+        model = _get_model(api_key)
         
         today = datetime.now()
         prompt = f"""{GEMINI_EVENT_PROMPT}
@@ -96,7 +235,7 @@ Search for real events happening in {location} this week and next week.
 Return ONLY events you can verify from your search.
 """
         
-        response = model.generate_content(prompt)
+        response = await _gemini_generate(model, prompt)
         
         # Track usage
         track_gemini_usage(response)
@@ -104,23 +243,17 @@ Return ONLY events you can verify from your search.
         text = response.text.strip()
         
         # Extract JSON from response
-        start = text.find('[')
-        end = text.rfind(']') + 1
+        events_list = parse_event_list(text, num_events)
         
-        if start != -1 and end > start:
-            events_list = json.loads(text[start:end])
-        else:
-            # Try finding object format
-            start = text.find('{')
-            end = text.rfind('}') + 1
-            if start != -1 and end > start:
-                data = json.loads(text[start:end])
-                events_list = data.get('events', [])
-            else:
-                events_list = []
+        # Carry coordinates forward for events already geocoded on a previous refresh
+        prev = load_events_from_file() or {}
+        prev_map = {
+            (e.get('name'), e.get('location', '')): e
+            for e in prev.get('events', []) if e.get('geocoded')
+        }
         
         # Geocode each event location
-        events_list = geocode_events(events_list[:num_events], location)
+        events_list = await geocode_events_async(events_list[:num_events], location, prev_map)
         
         return {
             "success": True,
@@ -134,29 +267,73 @@ Return ONLY events you can verify from your search.
     except Exception as e:
         return {"error": f"Gemini Error: {str(e)}"}
 
-def geocode_events(events, city):
-    """Add lat/lon coordinates to each event"""
-    geocoded = []
-    for event in events:
+def fetch_real_events(location, api_key, num_events=5):
+    """Sync wrapper around fetch_real_events_async"""
+    return asyncio.run(fetch_real_events_async(location, api_key, num_events))
+
+async def geocode_events_async(events, city, prev_map=None):
+    """
+    Add lat/lon coordinates to each event, one Nominatim request in flight at a time.
+    prev_map: {(name, location): event} of already-geocoded events to copy from.
+    """
+    prev_map = prev_map or {}
+    # Rate limit: Nominatim asks for 1 request/second. Spacing is measured from
+    # the start of the previous request, so round-trip time overlaps the wait.
+    sem = asyncio.Semaphore(1)
+    last_call = 0.0
+
+    async def gc(session, event):
+        nonlocal last_call
         location_str = event.get('location', '')
-        if location_str:
-            coords = geocode_location(location_str, city)
+        if not location_str:
+            return event
+        prev = prev_map.get((event.get('name'), location_str))
+        if prev:
+            event['lat'] = prev['lat']
+            event['lon'] = prev['lon']
+            event['geocoded'] = True
+            return event
+        # Cache hits skip the network and the rate-limit wait entirely
+        coords = get_cached_geocode(location_str, city)
+        if coords is None:
+            async with sem:
+                wait = 1.0 - (time.monotonic() - last_call)
+                await asyncio.sleep(max(0, wait))
+                last_call = time.monotonic()
+                coords = await geocode_location_async(session, location_str, city)
             if coords:
-                event['lat'] = coords['lat']
-                event['lon'] = coords['lon']
-                event['geocoded'] = True
-            else:
-                event['geocoded'] = False
-            # Rate limit: Nominatim asks for 1 request/second
-            time.sleep(1)
-        geocoded.append(event)
-    return geocoded
+                set_cached_geocode(location_str, city, coords)
+        if coords:
+            event['lat'] = coords['lat']
+            event['lon'] = coords['lon']
+            event['geocoded'] = True
+        else:
+            event['geocoded'] = False
+        return event
+
+    timeout = aiohttp.ClientTimeout(total=10)
+    async with aiohttp.ClientSession(headers=NOMINATIM_HEADERS, timeout=timeout) as session:
+        return await asyncio.gather(*[gc(session, evt) for evt in events])
+
+def _format_last_updated(iso_str):
+    try:
+        return datetime.fromisoformat(iso_str).strftime("%b %d, %Y %I:%M %p")
+    except (TypeError, ValueError):
+        return iso_str
+
+def _write_events_file(events_data):
+    """Write events.json and refresh the in-memory copy; raises on failure"""
+    # Pre-render the sidebar timestamp so reads don't have to
+    if events_data.get("last_updated"):
+        events_data["last_updated_display"] = _format_last_updated(events_data["last_updated"])
+    with open(EVENTS_FILE, 'wb') as f:
+        f.write(json_dumps_bytes(events_data, indent=True))
+    _events_cache.update(mtime=EVENTS_FILE.stat().st_mtime_ns, data=events_data)
 
 def save_events_to_file(events_data):
     """Save events to local JSON file"""
     try:
-        with open(EVENTS_FILE, 'w') as f:
-            json.dump(events_data, f, indent=2)
+        _write_events_file(events_data)
         return True
     except Exception as e:
         st.error(f"Failed to save events: {str(e)}")
@@ -166,101 +343,322 @@ def load_events_from_file():
     """Load events from local JSON file"""
     try:
         if EVENTS_FILE.exists():
-            with open(EVENTS_FILE, 'r') as f:
-                return json.load(f)
+            mtime = EVENTS_FILE.stat().st_mtime_ns
+            if _events_cache["mtime"] == mtime:
+                return _events_cache["data"]
+            data = load_json_file(EVENTS_FILE)
+            _events_cache.update(mtime=mtime, data=data)
+            return data
         return None
     except Exception as e:
         st.error(f"Failed to load events: {str(e)}")
         return None
 
-def get_events_last_updated():
-    """Get timestamp of last event refresh"""
-    events = load_events_from_file()
+def get_events_last_updated(events=None):
+    """Get timestamp of last event refresh, from already-loaded events if given"""
+    if events is None:
+        events = load_events_from_file()
+    if events and "last_updated_display" in events:
+        return events["last_updated_display"]
     if events and "last_updated" in events:
-        try:
-            dt = datetime.fromisoformat(events["last_updated"])
-            return dt.strftime("%b %d, %Y %I:%M %p")
-        except:
-            return events["last_updated"]
+        # Files saved before the display field existed
+        return _format_last_updated(events["last_updated"])
     return "Never"
 
-# --- Route Generation (Gemini + OpenRouteService) ---
+_refresh_lock = threading.Lock()
 
-def generate_gemini_route(route_request, user_location, api_key, ors_api_key=None):
-    """Generate route using Gemini for planning + OpenRouteService for real paths"""
-    if not GEMINI_AVAILABLE:
-        return None
-    
+def _refresh_events_in_background(location, api_key, num_events):
+    """Runs after the script run that started it may have ended, so it logs rather than renders"""
+    if not _refresh_lock.acquire(blocking=False):
+        return  # A refresh is already running
     try:
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('gemini-2.0-flash-exp')
-        
-        weather = get_weather_info(user_location[0], user_location[1])
-        now = datetime.now()
-        
-        # Load real events WITH coordinates
-        events = load_events_from_file()
-        events_context = ""
-        geocoded_events = []
-        
-        if events and events.get("events"):
-            for evt in events["events"]:
-                if evt.get("geocoded") and evt.get("lat") and evt.get("lon"):
-                    geocoded_events.append(evt)
-            
-            events_context = "VERIFIED LOCAL EVENTS WITH COORDINATES:\n"
-            for evt in geocoded_events:
-                events_context += f"- {evt['name']} at {evt.get('location', 'unknown')}\n"
-                events_context += f"  Coordinates: [{evt['lat']}, {evt['lon']}]\n"
-                events_context += f"  Date/Time: {evt.get('date', 'TBD')} {evt.get('time', '')}\n\n"
-        
-        prompt = f"""{GEMINI_ROUTING_PROMPT}
+        result = fetch_real_events(location, api_key, num_events)
+        if not result.get("success"):
+            logger.warning("Background event refresh failed: %s", result.get("error"))
+            return
+        try:
+            _write_events_file(result)
+        except Exception as e:
+            logger.warning("Background event refresh could not save: %s", e)
+    finally:
+        _refresh_lock.release()
+
+def get_events_swr(location, api_key, num_events=5, ttl=600, stale=3600, force=False):
+    """
+    Stale-while-revalidate event fetch (ttl/stale in seconds).
+    Younger than ttl: serve events.json as is. Younger than stale: serve it and
+    refresh in a background thread. Older (or missing), or force: fetch and save now.
+    The result carries a "source" of "cache", "stale" or "fresh".
+    """
+    if force:
+        result = fetch_real_events(location, api_key, num_events)
+        if result.get("success"):
+            save_events_to_file(result)
+        return {**result, "source": "fresh"}
+    
+    events = load_events_from_file()
+    age = None
+    if events and events.get("events") and "last_updated" in events:
+        try:
+            age = (datetime.now() - datetime.fromisoformat(events["last_updated"])).total_seconds()
+        except ValueError:
+            age = None
+    
+    if age is not None and age < ttl:
+        return {**events, "success": True, "source": "cache"}
+    
+    if age is not None and age < stale:
+        thread = threading.Thread(
+            target=_refresh_events_in_background,
+            args=(location, api_key, num_events),
+            daemon=True
+        )
+        thread.start()  # No script run context: it must not touch the page
+        return {**events, "success": True, "source": "stale"}
+    
+    result = fetch_real_events(location, api_key, num_events)
+    if result.get("success"):
+        save_events_to_file(result)
+    return {**result, "source": "fresh"}
+
+# --- Route Generation (Gemini + OpenRouteService) ---
+
+def _escape_format(text):
+    return text.replace("{", "{{").replace("}", "}}")
+
+# Static route instructions built once; only per-request fields are str.format slots
+_ROUTE_PROMPT_TEMPLATE = _escape_format(GEMINI_ROUTING_PROMPT) + """
         
-ROUTE REQUEST: {json.dumps(route_request)}
-CONTEXT: {now.strftime("%A %I:%M %p")}, Weather: {weather['condition']}
-LOCATION: {LOCATION_NAME}
-USER START LOCATION: {user_location[0]}, {user_location[1]}
+ROUTE REQUEST: {request}
+CONTEXT: {context}, Weather: {weather}
+LOCATION: """ + _escape_format(LOCATION_NAME) + """
+USER START LOCATION: {lat}, {lon}
 
 {events_context}
 
 IMPORTANT: 
 - Use the EXACT coordinates provided for events
-- Start from the user's location: [{user_location[0]}, {user_location[1]}]
+- Start from the user's location: [{lat}, {lon}]
 - Include waypoints that pass by the relevant event locations
 - Return waypoints in [lat, lon] format
 """
-        
-        response = model.generate_content(prompt)
-        
-        # Track usage
-        track_gemini_usage(response)
-        
-        text = response.text.strip()
-        
-        # Extract JSON
-        start = text.find('{')
-        end = text.rfind('}') + 1
-        route_data = json.loads(text[start:end])
-        route_data['weather'] = weather
-        
-        # If we have ORS API key, get real walking route
-        if ors_api_key and route_data.get('waypoints'):
-            real_route = get_real_walking_route(route_data['waypoints'], ors_api_key)
-            if real_route:
-                route_data['waypoints'] = real_route['coordinates']
-                route_data['real_distance'] = f"{real_route['distance_miles']} miles"
-                route_data['real_duration'] = f"{real_route['duration_minutes']} minutes"
-                route_data['route_type'] = 'road-following'
-            else:
-                route_data['route_type'] = 'straight-line (ORS failed)'
+
+def _route_events_context():
+    """Geocoded events as a compact JSON block for the routing prompt"""
+    events = load_events_from_file()
+    if not (events and events.get("events")):
+        return ""
+    
+    # Only the fields routing needs, compact, to keep prompt tokens down
+    slim = [
+        {k: evt[k] for k in ("name", "location", "lat", "lon", "date", "time") if evt.get(k)}
+        for evt in events["events"]
+        if evt.get("geocoded") and evt.get("lat") and evt.get("lon")
+    ]
+    return f"VERIFIED LOCAL EVENTS WITH COORDINATES (JSON):\n{json_dumps_bytes(slim).decode()}\n"
+
+def valid_waypoints(waypoints):
+    """
+    Numeric [lat, lon] pairs, converted in one vectorized pass; entries that
+    don't convert are skipped. Range checks are left to the evaluator's geofence.
+    """
+    try:
+        arr = np.asarray(waypoints, dtype=np.float64)
+    except (TypeError, ValueError):
+        # Ragged or non-numeric entries: slow path, keep whatever points convert
+        pairs = []
+        for wp in waypoints:
+            try:
+                pairs.append((float(wp[0]), float(wp[1])))
+            except (TypeError, ValueError, IndexError, KeyError):
+                continue
+        arr = np.array(pairs, dtype=np.float64).reshape(-1, 2)
+    if arr.ndim != 2 or arr.shape[1] < 2:
+        return []
+    return arr[:, :2].tolist()
+
+def _finish_route(route_data, weather, ors_api_key):
+    """Attach weather and, with an ORS key, swap in the real walking path"""
+    route_data['weather'] = weather
+    
+    # If we have ORS API key, get real walking route (ORS only gets the numeric points)
+    points = valid_waypoints(route_data.get('waypoints') or [])
+    if ors_api_key and points:
+        real_route = get_real_walking_route(points, ors_api_key)
+        if real_route:
+            route_data['waypoints'] = real_route['coordinates']
+            route_data['real_distance'] = f"{real_route['distance_miles']} miles"
+            route_data['real_duration'] = f"{real_route['duration_minutes']} minutes"
+            route_data['route_type'] = 'road-following'
         else:
-            route_data['route_type'] = 'straight-line (no ORS key)'
+            route_data['route_type'] = 'straight-line (ORS failed)'
+    else:
+        route_data['route_type'] = 'straight-line (no ORS key)'
+    
+    return route_data
+
+async def _plan_route_async(route_request, user_location, api_key, ors_api_key, weather):
+    """Gemini planning + ORS paths; raises on failure so errors are never cached"""
+    model = _get_model(api_key)
+    now = datetime.now()
+    
+    events_context = _route_events_context()
+    
+    prompt = _ROUTE_PROMPT_TEMPLATE.format(
+        request=json_dumps_bytes(route_request).decode(),
+        context=now.strftime("%A %I:%M %p"),
+        weather=weather['condition'],
+        lat=user_location[0],
+        lon=user_location[1],
+        events_context=events_context
+    )
+    
+    response = await _gemini_generate(model, prompt)
+    
+    # Track usage
+    track_gemini_usage(response)
+    
+    text = response.text.strip()
+    
+    # Extract JSON: decode the first complete object, ignoring any trailing prose
+    route_data, _ = _JSON_DECODER.raw_decode(text, text.index('{'))
+    return _finish_route(route_data, weather, ors_api_key)
+
+@st.cache_data(ttl=3600, max_entries=128, show_spinner=False)
+def _generate_route_cached(route_request_json, lat, lon, weather_bucket, use_ors, events_version,
+                           hour_bucket, _api_key, _ors_api_key, _weather):
+    """
+    Route generation memoized on the request, start, weather condition,
+    events.json version and clock hour. Underscored args are left out of the cache key.
+    """
+    return asyncio.run(_plan_route_async(
+        json_loads(route_request_json), [lat, lon], _api_key, _ors_api_key if use_ors else None, _weather
+    ))
+
+def generate_gemini_route(route_request, user_location, api_key, ors_api_key=None, weather=None):
+    """
+    Generate a route, reusing the result for an identical recent request.
+    Results also persist under .cache/routes, so hits cost no Gemini quota
+    even after a restart.
+    """
+    if not gemini_available():
+        return None
+    
+    try:
+        if weather is None:
+            weather = get_weather_info(user_location[0], user_location[1])
+        events_version = EVENTS_FILE.stat().st_mtime_ns if EVENTS_FILE.exists() else 0
+        condition = weather['condition']  # Bucket by condition only, not temperature
+        hour_bucket = datetime.now().strftime("%Y-%m-%d-%H")  # The prompt carries the time of day
         
+        key = route_cache_key(route_request, user_location,
+                              [GEMINI_MODEL, condition, bool(ors_api_key), events_version, hour_bucket])
+        route_data = get_cached_route(key)
+        if route_data is not None:
+            return route_data
+        
+        route_data = _generate_route_cached(
+            json.dumps(route_request, sort_keys=True),
+            user_location[0], user_location[1],
+            condition, bool(ors_api_key), events_version, hour_bucket,
+            api_key, ors_api_key, weather
+        )
+        if route_data:
+            set_cached_route(key, route_data)
         return route_data
     except Exception as e:
         st.error(f"Gemini Error: {str(e)}")
         return None
 
+# --- Combined Chat + Route (Gemini only) ---
+
+_ROUTE_JSON_TAG = "[ROUTE_JSON]"
+
+# Same persona and [ROUTE_REQUEST] format as the Ollama chat, with the route
+# plan appended so a single call replaces the Ollama + Gemini round trips
+_CHAT_ROUTE_PROMPT_TEMPLATE = _escape_format(OLLAMA_SYSTEM_PROMPT) + """
+
+{events}
+{events_context}
+CONTEXT: {context}, Weather: {weather}
+USER START LOCATION: {lat}, {lon}
+
+User: {message}
+
+If your reply includes a [ROUTE_REQUEST] block, end the response with a line
+containing only """ + _ROUTE_JSON_TAG + """ followed by the route plan for that request.
+Start the route from the user's location and use the EXACT event coordinates.
+
+ROUTE PLANNING INSTRUCTIONS:
+""" + _escape_format(GEMINI_ROUTING_PROMPT)
+
+def _chat_route_prompt(message, user_location, weather):
+    return _CHAT_ROUTE_PROMPT_TEMPLATE.format(
+        events=build_event_context(),
+        events_context=_route_events_context(),
+        context=datetime.now().strftime("%A %I:%M %p"),
+        weather=weather['condition'],
+        lat=user_location[0],
+        lon=user_location[1],
+        message=message
+    )
+
+def _split_chat_route(text, weather, ors_api_key):
+    """(reply, route_data) from a combined reply; route_data is None without a plan"""
+    reply, _, plan = text.partition(_ROUTE_JSON_TAG)
+    route_data = None
+    if '{' in plan:
+        route_data, _ = _JSON_DECODER.raw_decode(plan, plan.index('{'))
+        route_data = _finish_route(route_data, weather, ors_api_key)
+    return reply.strip(), route_data
+
+async def _chat_route_async(message, user_location, api_key, ors_api_key, weather):
+    """Chat reply and optional route plan from one Gemini call"""
+    model = _get_model(api_key)
+    response = await _gemini_generate(model, _chat_route_prompt(message, user_location, weather))
+    track_gemini_usage(response)
+    return _split_chat_route(response.text, weather, ors_api_key)
+
+def gemini_chat_route(message, user_location, api_key, ors_api_key=None, weather=None):
+    """
+    Answer the user and plan any requested route in a single Gemini call.
+    Returns (reply, route_data); route_data is None if no route was requested.
+    """
+    if not gemini_available():
+        return None, None
+    
+    try:
+        if weather is None:
+            weather = get_weather_info(user_location[0], user_location[1])
+        return asyncio.run(_chat_route_async(message, user_location, api_key, ors_api_key, weather))
+    except Exception as e:
+        st.error(f"Gemini Error: {str(e)}")
+        return None, None
+
+def stream_gemini_chat(message, user_location, api_key, weather):
+    """
+    Yield the combined reply's text as Gemini generates it, so the chat shows
+    the first tokens instead of waiting for the whole route JSON.
+    Pass the joined text to route_from_chat_reply afterwards.
+    """
+    if not gemini_available():
+        return
+    
+    try:
+        model = _get_model(api_key)
+        response = yield from _gemini_stream(model, _chat_route_prompt(message, user_location, weather))
+        track_gemini_usage(response)  # usage_metadata is complete once the stream is drained
+    except Exception as e:
+        st.error(f"Gemini Error: {str(e)}")
+
+def route_from_chat_reply(text, weather, ors_api_key=None):
+    """Parse a streamed combined reply into (reply, route_data)"""
+    try:
+        return _split_chat_route(text, weather, ors_api_key)
+    except ValueError as e:
+        st.error(f"Gemini Error: {str(e)}")
+        return text.partition(_ROUTE_JSON_TAG)[0].strip(), None
+
 def get_real_walking_route(waypoints, ors_api_key):
     """Convert waypoints to real walking route using OpenRouteService"""
     if not waypoints or len(waypoints) < 2:
@@ -271,6 +669,6 @@ def get_real_walking_route(waypoints, ors_api_key):
         ors_coords = [[wp[1], wp[0]] for wp in waypoints]
         
         return get_walking_route(ors_coords, ors_api_key)
-    except Exception as e:
-        print(f"Real route error: {str(e)}")
+    except (IndexError, TypeError) as e:
+        logger.warning("Real route error: malformed waypoints (%s)", e)
         return None
\ No newline at end of file
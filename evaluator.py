@@ -1,9 +1,119 @@
 # evaluator.py
 import math
 import re
-from datetime import datetime
 from pathlib import Path
 import json
+import copy
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+EARTH_RADIUS_MILES = 3958.8
+EVENTS_FILE = Path("events.json")
+# Append-only JSON lines of [key, score, report]; compacted once it holds
+# twice SCORE_CACHE_SIZE lines. Bump SCORE_VERSION whenever scoring changes.
+SCORE_CACHE_FILE = Path(".cache/route_scores.jsonl")
+SCORE_CACHE_SIZE = 256
+SCORE_VERSION = 1
+# Summary per 40/60/80 score band and status per 0.4/0.7 check ratio, indexed by thresholds passed
+_SUMMARIES = ("Low quality route - significant issues",
+              "Poor quality route - review warnings",
+              "Acceptable route with some issues",
+              "Good quality route")
+_STATUSES = ("FAIL", "WARN", "PASS")
+EVENT_GRID_DEG = 0.01  # Event grid cell size, ~0.7 x 0.5 mi at Athens
+_NUMBER_RE = re.compile(r"\d+(?:\.\d+)?")
+
+def haversine_miles(a, b):
+    """Vectorized haversine distance in miles between [..., (lat, lon)] arrays (broadcasts)"""
+    a, b = np.radians(a), np.radians(b)
+    dlat = b[..., 0] - a[..., 0]
+    dlon = b[..., 1] - a[..., 1]
+    h = np.sin(dlat/2)**2 + np.cos(a[..., 0]) * np.cos(b[..., 0]) * np.sin(dlon/2)**2
+    return 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+
+def _haversine_pair(lat1, lon1, lat2, lon2):
+    """Scalar haversine distance in miles"""
+    lat1, lat2 = math.radians(lat1), math.radians(lat2)
+    dlat = lat2 - lat1
+    dlon = math.radians(lon2) - math.radians(lon1)
+    h = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
+    return 2 * EARTH_RADIUS_MILES * math.asin(math.sqrt(min(max(h, 0.0), 1.0)))
+
+def local_miles(a, b, cos_lat0):
+    """
+    Equirectangular distance in miles (broadcasts). Over the Athens bounding
+    box the error against haversine is well under 0.01%, with no per-pair trig.
+    """
+    d = np.radians(np.subtract(b, a))
+    return EARTH_RADIUS_MILES * np.hypot(d[..., 0], d[..., 1] * cos_lat0)
+
+def _local_pair(lat1, lon1, lat2, lon2, cos_lat0):
+    """Scalar equirectangular distance in miles"""
+    dlat = math.radians(lat2 - lat1)
+    dlon = math.radians(lon2 - lon1) * cos_lat0
+    return EARTH_RADIUS_MILES * math.sqrt(dlat * dlat + dlon * dlon)
+
+if NUMBA_AVAILABLE:
+    _haversine_pair = njit(cache=True)(_haversine_pair)
+    _local_pair = njit(cache=True)(_local_pair)
+
+def _grid_keys(coords):
+    """Packed int64 EVENT_GRID_DEG cell key for each [lat, lon] row"""
+    cells = np.floor(coords / EVENT_GRID_DEG).astype(np.int64)
+    # Offset lon cells into [0, 2**32) so a +-1 neighbor delta never carries into the lat bits
+    return (cells[:, 0] << 32) + (cells[:, 1] + (1 << 31))
+
+# Key deltas for a cell's 3x3 neighborhood
+_GRID_NEIGHBORS = np.array([(dlat << 32) + dlon for dlat in (-1, 0, 1) for dlon in (-1, 0, 1)], dtype=np.int64)
+
+def _route_geometry_np(wp, bounds, cos_lat0):
+    """
+    Per-segment miles and an out-of-bounds mask for an (N, 2) waypoint array.
+    Segments with an endpoint outside the bounds fall back to full haversine.
+    """
+    outside = ((wp < bounds[0]) | (wp > bounds[1])).any(axis=1)
+    segments = local_miles(wp[:-1], wp[1:], cos_lat0)
+    far = outside[:-1] | outside[1:]
+    if far.any():
+        segments[far] = haversine_miles(wp[:-1][far], wp[1:][far])
+    return segments, outside
+
+if NUMBA_AVAILABLE:
+    @njit(cache=True)
+    def _route_geometry(wp, bounds, cos_lat0):
+        """Compiled single-pass version of _route_geometry_np"""
+        n = wp.shape[0]
+        segments = np.empty(max(n - 1, 0))
+        outside = np.empty(n, dtype=np.bool_)
+        min_lat, min_lon = bounds[0, 0], bounds[0, 1]
+        max_lat, max_lon = bounds[1, 0], bounds[1, 1]
+        # Bitwise | rather than `or`, so the bounds test compiles without branches
+        for i in range(n):
+            lat, lon = wp[i, 0], wp[i, 1]
+            outside[i] = (lat < min_lat) | (lon < min_lon) | (lat > max_lat) | (lon > max_lon)
+        for i in range(n - 1):
+            if outside[i] or outside[i + 1]:
+                segments[i] = _haversine_pair(wp[i, 0], wp[i, 1], wp[i + 1, 0], wp[i + 1, 1])
+            else:
+                segments[i] = _local_pair(wp[i, 0], wp[i, 1], wp[i + 1, 0], wp[i + 1, 1], cos_lat0)
+        return segments, outside
+else:
+    _route_geometry = _route_geometry_np
 
 class RouteEvaluator:
     """
@@ -15,12 +125,17 @@ class RouteEvaluator:
     def __init__(self, target_lat=39.3292, target_lon=-82.1013, radius_miles=5.0):
         self.center = (target_lat, target_lon)
         self.radius = radius_miles
+        self._cos_lat0 = math.cos(math.radians(target_lat))  # Equirectangular scale for in-bounds distances
         
         # Bounding box for Athens, OH
         self.bounds = {
             'min_lat': 39.2, 'max_lat': 39.45,
             'min_lon': -82.25, 'max_lon': -81.95
         }
+        self._bounds_arr = np.array([
+            [self.bounds['min_lat'], self.bounds['min_lon']],
+            [self.bounds['max_lat'], self.bounds['max_lon']]
+        ])
         
         # Scoring weights (total = 100)
         self.weights = {
@@ -35,42 +150,180 @@ class RouteEvaluator:
         # Walking speed bounds (mph)
         self.min_walk_speed = 1.5
         self.max_walk_speed = 4.5
+        
+        # LRU of per-route waypoint stats, keyed on the raw waypoint bytes. One
+        # evaluator may be shared by every session, hence the lock.
+        self._geom_cache = OrderedDict()
+        self.geom_cache_size = 64
+        self._lock = threading.Lock()
+        
+        # Geocoded events as (mtime, names, (E, 2) coords, grid keys); reloaded when events.json changes
+        self._events_cache = (None, [], np.empty((0, 2)), np.empty(0, dtype=np.int64))
+        
+        # Persisted (score, report) by content hash of everything score_route reads
+        self._score_cache, self._score_lines = self._load_score_cache()
 
     def haversine_distance(self, coord1, coord2):
         """Calculate distance in miles between two lat/lon points"""
-        R = 3958.8  # Earth radius in miles
-        lat1, lon1 = math.radians(coord1[0]), math.radians(coord1[1])
-        lat2, lon2 = math.radians(coord2[0]), math.radians(coord2[1])
-        dlat = lat2 - lat1
-        dlon = lon2 - lon1
-        a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
-        c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-        return R * c
+        return _haversine_pair(float(coord1[0]), float(coord1[1]), float(coord2[0]), float(coord2[1]))
+
+    def _local_distance(self, coord1, coord2):
+        """Equirectangular distance in miles; only accurate for points inside self.bounds"""
+        return _local_pair(float(coord1[0]), float(coord1[1]), float(coord2[0]), float(coord2[1]), self._cos_lat0)
+
+    def _analyze(self, waypoints):
+        """
+        Everything the checks need from the waypoints, computed in one place:
+        segment miles, path/direct distance, bounds mask, unique and tiny-gap
+        counts. Reused when a route is rescored.
+        """
+        key = waypoints.tobytes()
+        with self._lock:
+            cached = self._geom_cache.get(key)
+            if cached is not None:
+                self._geom_cache.move_to_end(key)
+                return cached
+        segments, outside = _route_geometry(waypoints, self._bounds_arr, self._cos_lat0)
+        segments.setflags(write=False)
+        outside.setflags(write=False)
+        
+        # Pack the 1e-5 deg grid cell into one int64 so np.unique runs on a
+        # flat array rather than comparing rows
+        q = np.rint(waypoints * 1e5).astype(np.int64)
+        stats = {
+            'count': len(waypoints),
+            'segments': segments,
+            'path_distance': float(segments.sum()),
+            'direct_distance': (self.haversine_distance(waypoints[0], waypoints[-1])
+                                if outside[0] or outside[-1]
+                                else self._local_distance(waypoints[0], waypoints[-1])),
+            'outside': outside,
+            'unique_count': len(np.unique((q[:, 0] << 32) | (q[:, 1] & 0xFFFFFFFF))),
+            'tiny_gaps': int((segments < 0.001).sum()),  # Less than 5 feet
+        }
+        with self._lock:
+            self._geom_cache[key] = stats
+            if len(self._geom_cache) > self.geom_cache_size:
+                self._geom_cache.popitem(last=False)
+        return stats
 
     def extract_number(self, text):
         """Extract first number from string"""
-        try:
-            match = re.search(r"(\d+(\.\d+)?)", str(text))
-            return float(match.group(1)) if match else 0.0
-        except:
-            return 0.0
+        match = _NUMBER_RE.search(str(text))
+        return float(match.group()) if match else 0.0
 
     def load_events(self):
-        """Load events from events.json"""
+        """Load events from events.json (orjson when installed)"""
         try:
-            events_file = Path("events.json")
-            if events_file.exists():
-                with open(events_file, 'r') as f:
-                    data = json.load(f)
-                    return data.get("events", [])
+            if EVENTS_FILE.exists():
+                raw = EVENTS_FILE.read_bytes()
+                data = orjson.loads(raw) if ORJSON_AVAILABLE else json.loads(raw)
+                return data.get("events", [])
             return []
         except:
             return []
 
+    def _events_mtime(self):
+        """events.json mtime in ns, or None if it's missing"""
+        try:
+            return EVENTS_FILE.stat().st_mtime_ns
+        except OSError:
+            return None
+
+    def geocoded_events(self, mtime):
+        """
+        One consistent snapshot of geocoded events: names, (E, 2) [lat, lon]
+        array and grid keys. Parsed only when events.json's mtime changes.
+        """
+        with self._lock:
+            cache = self._events_cache
+        if cache[0] != mtime or mtime is None:
+            events = [e for e in self.load_events() if e.get('geocoded') and e.get('lat') and e.get('lon')]
+            coords = np.array([(e['lat'], e['lon']) for e in events], dtype=np.float64).reshape(-1, 2)
+            cache = (mtime, [e['name'] for e in events], coords, _grid_keys(coords))
+            with self._lock:
+                self._events_cache = cache
+        return cache[1], cache[2], cache[3]
+
+    def _events_near(self, waypoints, event_keys):
+        """
+        Mask of events (by grid key) in the 3x3 grid neighborhood of some waypoint.
+        Anything else is over one cell (0.5 mi) from every waypoint.
+        """
+        route_keys = np.unique(_grid_keys(waypoints))
+        return np.isin(event_keys, (route_keys[:, None] + _GRID_NEIGHBORS).ravel())
+
+    def _load_score_cache(self):
+        """Newest SCORE_CACHE_SIZE entries from SCORE_CACHE_FILE, and its line count"""
+        cache = {}
+        try:
+            lines = SCORE_CACHE_FILE.read_bytes().splitlines()
+        except OSError:
+            return cache, 0
+        for line in lines:
+            try:
+                key, score, report = orjson.loads(line) if ORJSON_AVAILABLE else json.loads(line)
+            except (ValueError, TypeError):
+                continue  # Torn or foreign line
+            cache.pop(key, None)  # Later lines win and count as newest
+            cache[key] = [score, report]
+        while len(cache) > SCORE_CACHE_SIZE:
+            cache.pop(next(iter(cache)))
+        return cache, len(lines)
+
+    def _persist_score(self, key, entry):
+        """Append one entry, or rewrite the file compacted once it has grown; caller holds the lock"""
+        dumps = orjson.dumps if ORJSON_AVAILABLE else (lambda o: json.dumps(o).encode())
+        try:
+            SCORE_CACHE_FILE.parent.mkdir(exist_ok=True)
+            if self._score_lines + 1 > 2 * SCORE_CACHE_SIZE:
+                tmp = SCORE_CACHE_FILE.with_suffix(".tmp")
+                tmp.write_bytes(b"".join(dumps([k, *v]) + b"\n" for k, v in self._score_cache.items()))
+                os.replace(tmp, SCORE_CACHE_FILE)  # Atomic, readers never see a partial file
+                self._score_lines = len(self._score_cache)
+            else:
+                with open(SCORE_CACHE_FILE, 'ab') as f:
+                    f.write(dumps([key, *entry]) + b"\n")
+                self._score_lines += 1
+        except OSError:
+            pass  # Cache is best-effort
+
+    def _score_key(self, route_data, events_mtime):
+        """Hash of the scored fields, events.json version and scoring config"""
+        fields = ('waypoints', 'total_distance', 'estimated_time',
+                  'route_description', 'points_of_interest', 'local_events')
+        payload = {
+            'route': {f: route_data.get(f) for f in fields},
+            'events_mtime': events_mtime,
+            'version': SCORE_VERSION,
+            'config': [self.center, self.bounds, self.weights, self.min_walk_speed, self.max_walk_speed],
+        }
+        blob = json.dumps(payload, sort_keys=True, default=lambda o: o.tolist() if hasattr(o, 'tolist') else str(o))
+        return hashlib.sha1(blob.encode()).hexdigest()
+
     def score_route(self, route_data):
         """
         Main scoring function. Returns total score and detailed report.
+        Results persist in SCORE_CACHE_FILE, so an unchanged route isn't rescored.
+        The report is the caller's own copy; changing it doesn't touch the cache.
         """
+        events_mtime = self._events_mtime()  # The only stat of events.json per call
+        key = self._score_key(route_data, events_mtime)
+        with self._lock:
+            cached = self._score_cache.get(key)
+        if cached is not None:
+            return cached[0], copy.deepcopy(cached[1])
+        
+        score, report = self._score_route(route_data, events_mtime)
+        with self._lock:
+            self._score_cache[key] = [score, report]
+            while len(self._score_cache) > SCORE_CACHE_SIZE:
+                self._score_cache.pop(next(iter(self._score_cache)))  # Oldest first
+            self._persist_score(key, [score, report])
+        return score, copy.deepcopy(report)
+
+    def _score_route(self, route_data, events_mtime):
+        """Uncached scoring"""
         report = {
             'total_score': 0,
             'max_score': 100,
@@ -88,13 +341,17 @@ class RouteEvaluator:
             report['summary'] = "Route failed - no waypoints"
             return report['total_score'], report
         
+        # (N, 2) array, analyzed once; the checks below only score the stats
+        waypoints = np.ascontiguousarray(waypoints, dtype=np.float64)
+        stats = self._analyze(waypoints)
+        
         # Run all checks
         report['checks']['completeness'] = self._check_completeness(route_data)
-        report['checks']['waypoint_quality'] = self._check_waypoint_quality(waypoints)
-        report['checks']['geofence'] = self._check_geofence(waypoints)
-        report['checks']['route_efficiency'] = self._check_efficiency(waypoints)
-        report['checks']['speed_sanity'] = self._check_speed(route_data, waypoints)
-        report['checks']['event_proximity'] = self._check_event_proximity(route_data, waypoints)
+        report['checks']['waypoint_quality'] = self._check_waypoint_quality(stats)
+        report['checks']['geofence'] = self._check_geofence(stats)
+        report['checks']['route_efficiency'] = self._check_efficiency(stats)
+        report['checks']['speed_sanity'] = self._check_speed(route_data, stats)
+        report['checks']['event_proximity'] = self._check_event_proximity(route_data, waypoints, events_mtime)
         
         # Calculate total score
         total = 0
@@ -106,14 +363,7 @@ class RouteEvaluator:
         report['total_score'] = int(total)
         
         # Generate summary
-        if total >= 80:
-            report['summary'] = "Good quality route"
-        elif total >= 60:
-            report['summary'] = "Acceptable route with some issues"
-        elif total >= 40:
-            report['summary'] = "Poor quality route - review warnings"
-        else:
-            report['summary'] = "Low quality route - significant issues"
+        report['summary'] = _SUMMARIES[(total >= 40) + (total >= 60) + (total >= 80)]
         
         return report['total_score'], report
 
@@ -131,21 +381,15 @@ class RouteEvaluator:
         optional_fields = ['route_description', 'points_of_interest', 'local_events']
         
         # Required fields (60% of score)
-        required_present = 0
-        for field in required_fields:
-            if route_data.get(field):
-                required_present += 1
-                result['details'].append(f"{field}: present")
-            else:
-                result['warnings'].append(f"Missing required field: {field}")
+        present = [f for f in required_fields if route_data.get(f)]
+        required_present = len(present)
+        result['details'] = [f"{field}: present" for field in present]
+        result['warnings'] = [f"Missing required field: {field}" for field in required_fields if field not in present]
         
         required_score = (required_present / len(required_fields)) * 0.6 * result['max']
         
         # Optional fields (40% of score)
-        optional_present = 0
-        for field in optional_fields:
-            if route_data.get(field):
-                optional_present += 1
+        optional_present = sum(1 for f in optional_fields if route_data.get(f))
         
         optional_score = (optional_present / len(optional_fields)) * 0.4 * result['max']
         
@@ -154,7 +398,7 @@ class RouteEvaluator:
         
         return result
 
-    def _check_waypoint_quality(self, waypoints):
+    def _check_waypoint_quality(self, stats):
         """Check waypoint count, duplicates, and spacing"""
         result = {
             'name': 'Waypoint Quality',
@@ -164,7 +408,7 @@ class RouteEvaluator:
             'warnings': []
         }
         
-        count = len(waypoints)
+        count = stats['count']
         
         # Check count (want at least 5 for a smooth route)
         if count >= 10:
@@ -180,27 +424,18 @@ class RouteEvaluator:
         result['details'].append(f"Waypoint count: {count}")
         
         # Check for duplicates
-        unique_points = set()
-        duplicates = 0
-        for wp in waypoints:
-            key = (round(wp[0], 5), round(wp[1], 5))
-            if key in unique_points:
-                duplicates += 1
-            unique_points.add(key)
+        unique_count = stats['unique_count']
+        duplicates = count - unique_count
         
         if duplicates > 0:
             duplicate_penalty = min(duplicates * 0.1, 0.3)
             count_score -= duplicate_penalty
             result['warnings'].append(f"Found {duplicates} duplicate waypoints")
         
-        result['details'].append(f"Unique points: {len(unique_points)}")
+        result['details'].append(f"Unique points: {unique_count}")
         
         # Check spacing (detect if points are too close together)
-        tiny_gaps = 0
-        for i in range(len(waypoints) - 1):
-            dist = self.haversine_distance(waypoints[i], waypoints[i+1])
-            if dist < 0.001:  # Less than 5 feet
-                tiny_gaps += 1
+        tiny_gaps = stats['tiny_gaps']
         
         if tiny_gaps > count * 0.3:
             count_score -= 0.2
@@ -210,7 +445,7 @@ class RouteEvaluator:
         
         return result
 
-    def _check_geofence(self, waypoints):
+    def _check_geofence(self, stats):
         """Check if waypoints are within Athens area"""
         result = {
             'name': 'Geofence',
@@ -220,18 +455,10 @@ class RouteEvaluator:
             'warnings': []
         }
         
-        in_bounds = 0
-        out_of_bounds = []
-        
-        for i, wp in enumerate(waypoints):
-            lat, lon = wp[0], wp[1]
-            if (self.bounds['min_lat'] <= lat <= self.bounds['max_lat'] and 
-                self.bounds['min_lon'] <= lon <= self.bounds['max_lon']):
-                in_bounds += 1
-            else:
-                out_of_bounds.append(i)
+        out_of_bounds = np.flatnonzero(stats['outside']).tolist()
         
-        total = len(waypoints)
+        total = stats['count']
+        in_bounds = total - len(out_of_bounds)
         ratio = in_bounds / total if total > 0 else 0
         
         result['score'] = round(ratio * result['max'], 1)
@@ -242,7 +469,7 @@ class RouteEvaluator:
         
         return result
 
-    def _check_efficiency(self, waypoints):
+    def _check_efficiency(self, stats):
         """Check if route is reasonably direct (not zigzagging)"""
         result = {
             'name': 'Route Efficiency',
@@ -252,17 +479,15 @@ class RouteEvaluator:
             'warnings': []
         }
         
-        if len(waypoints) < 2:
+        if stats['count'] < 2:
             result['score'] = 0
             return result
         
         # Calculate actual path distance
-        path_distance = 0
-        for i in range(len(waypoints) - 1):
-            path_distance += self.haversine_distance(waypoints[i], waypoints[i+1])
+        path_distance = stats['path_distance']
         
         # Calculate direct distance (start to end)
-        direct_distance = self.haversine_distance(waypoints[0], waypoints[-1])
+        direct_distance = stats['direct_distance']
         
         # Efficiency ratio (1.0 = perfectly direct, lower = more wandering)
         # For walking routes, 0.3-0.7 is reasonable (you want some exploration)
@@ -296,7 +521,7 @@ class RouteEvaluator:
         
         return result
 
-    def _check_speed(self, route_data, waypoints):
+    def _check_speed(self, route_data, stats):
         """Check if time/distance implies reasonable walking speed"""
         result = {
             'name': 'Speed Sanity',
@@ -311,9 +536,7 @@ class RouteEvaluator:
         claimed_time = self.extract_number(route_data.get('estimated_time', '0'))
         
         # Calculate actual distance from waypoints
-        actual_distance = 0
-        for i in range(len(waypoints) - 1):
-            actual_distance += self.haversine_distance(waypoints[i], waypoints[i+1])
+        actual_distance = stats['path_distance']
         
         result['details'].append(f"Claimed distance: {claimed_distance} mi")
         result['details'].append(f"Calculated distance: {actual_distance:.2f} mi")
@@ -354,7 +577,7 @@ class RouteEvaluator:
         
         return result
 
-    def _check_event_proximity(self, route_data, waypoints):
+    def _check_event_proximity(self, route_data, waypoints, events_mtime):
         """Check if route passes near claimed events"""
         result = {
             'name': 'Event Proximity',
@@ -364,11 +587,10 @@ class RouteEvaluator:
             'warnings': []
         }
         
-        # Load actual events with coordinates
-        events = self.load_events()
-        geocoded_events = [e for e in events if e.get('geocoded') and e.get('lat') and e.get('lon')]
+        # Actual events with coordinates
+        event_names, event_coords, event_keys = self.geocoded_events(events_mtime)
         
-        if not geocoded_events:
+        if not event_names:
             result['score'] = result['max'] * 0.5  # Neutral if no events to check
             result['details'].append("No geocoded events to verify against")
             return result
@@ -383,29 +605,32 @@ class RouteEvaluator:
             return result
         
         # Check proximity of route to each geocoded event
-        events_near_route = 0
         proximity_threshold = 0.2  # miles
         
-        for event in geocoded_events:
-            event_coord = (event['lat'], event['lon'])
-            min_distance = float('inf')
-            
-            # Find minimum distance from any waypoint to this event
-            for wp in waypoints:
-                dist = self.haversine_distance(wp, event_coord)
-                min_distance = min(min_distance, dist)
-            
-            if min_distance <= proximity_threshold:
-                events_near_route += 1
-                result['details'].append(f"PASS: {event['name']} - {min_distance:.2f} mi from route")
+        # Grid lookup first: only events in a cell next to the route can be
+        # within the threshold, so the rest skip haversine entirely
+        candidate = self._events_near(waypoints, event_keys)
+        
+        # Minimum distance from any waypoint to each candidate, as one (events x waypoints) op
+        min_distances = np.full(len(event_names), np.inf)
+        if candidate.any():
+            min_distances[candidate] = haversine_miles(
+                event_coords[candidate][:, None, :], waypoints[None, :, :]
+            ).min(axis=1)
+        near = min_distances <= proximity_threshold
+        events_near_route = int(near.sum())
+        
+        for name, min_distance, hit in zip(event_names, min_distances.tolist(), near.tolist()):
+            if math.isinf(min_distance):
+                result['details'].append(f"MISS: {name} - >0.5 mi from route")
             else:
-                result['details'].append(f"MISS: {event['name']} - {min_distance:.2f} mi from route")
+                result['details'].append(f"{'PASS' if hit else 'MISS'}: {name} - {min_distance:.2f} mi from route")
         
         # Score based on how many events the route passes
-        if geocoded_events:
-            ratio = events_near_route / len(geocoded_events)
+        if event_names:
+            ratio = events_near_route / len(event_names)
             result['score'] = round(ratio * result['max'], 1)
-            result['details'].append(f"Route passes {events_near_route}/{len(geocoded_events)} events within {proximity_threshold} mi")
+            result['details'].append(f"Route passes {events_near_route}/{len(event_names)} events within {proximity_threshold} mi")
             
             if events_near_route == 0:
                 result['warnings'].append("Route does not pass near any known events")
@@ -422,7 +647,7 @@ class RouteEvaluator:
         lines.append("")
         
         for check_name, check in report['checks'].items():
-            status = "PASS" if check['score'] >= check['max'] * 0.7 else "WARN" if check['score'] >= check['max'] * 0.4 else "FAIL"
+            status = _STATUSES[(check['score'] >= check['max'] * 0.4) + (check['score'] >= check['max'] * 0.7)]
             lines.append(f"[{status}] {check['name']}: {check['score']}/{check['max']}")
             for detail in check['details']:
                 lines.append(f"      {detail}")
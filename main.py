@@ -1,7 +1,8 @@
 # main.py
 import streamlit as st
-import folium
-from streamlit_folium import st_folium
+import numpy as np
+import streamlit.components.v1 as components
+from concurrent.futures import ThreadPoolExecutor
 
 # Import our modules
 import config
@@ -12,8 +13,13 @@ from evaluator import RouteEvaluator
 # --- Page Config ---
 st.set_page_config(page_title="Local Community Explorer", layout="wide")
 
+CHAT_RECENT_MESSAGES = 20
+
 # --- Session State ---
-if "routes" not in st.session_state: st.session_state.routes = []
+# Saved routes, stored contiguously: route i is route_coords[route_offsets[i]:route_offsets[i+1]]
+# (float32, ~1 m precision at these coordinates)
+if "route_coords" not in st.session_state: st.session_state.route_coords = np.empty((0, 2), dtype=np.float32)
+if "route_offsets" not in st.session_state: st.session_state.route_offsets = [0]
 if "chat_history" not in st.session_state: st.session_state.chat_history = []
 if "gemini_api_key" not in st.session_state: st.session_state.gemini_api_key = ""
 if "ors_api_key" not in st.session_state: st.session_state.ors_api_key = ""
@@ -21,17 +27,34 @@ if "map_center" not in st.session_state: st.session_state.map_center = [config.D
 if "debug_mode" not in st.session_state: st.session_state.debug_mode = False
 if "last_evaluation" not in st.session_state: st.session_state.last_evaluation = None
 if "last_route_data" not in st.session_state: st.session_state.last_route_data = None
+if "events_checked" not in st.session_state: st.session_state.events_checked = False
 
 # Initialize usage tracking
 utils.init_gemini_usage()
 
+@st.cache_resource
+def get_evaluator():
+    """One evaluator per process; it keeps its parsed events and route geometry between reruns"""
+    return RouteEvaluator()
+
+@st.cache_resource
+def get_executor():
+    """Worker pool for independent I/O that can overlap the LLM calls"""
+    return ThreadPoolExecutor(max_workers=4)
+
 # --- Sidebar ---
 with st.sidebar:
     st.title("Config")
     
     # --- Status Indicators ---
     ollama_ok = agent_logic.check_ollama()
-    st.write("Ollama:", "Ready" if ollama_ok else "Offline")
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        st.write("Ollama:", "Ready" if ollama_ok else "Offline")
+    with col2:
+        if st.button("Recheck", key="recheck_ollama"):
+            agent_logic.check_ollama.clear()
+            st.rerun()
     
     # --- API Keys ---
     key = st.text_input("Gemini API Key", value=st.session_state.gemini_api_key, type="password")
@@ -49,25 +72,39 @@ with st.sidebar:
     # --- Event Management ---
     st.subheader("Local Events")
     
-    last_updated = agent_logic.get_events_last_updated()
-    st.caption(f"Last updated: {last_updated}")
+    # First run with a key: serve saved events, refreshing them in the background
+    # once they pass the ttl (or fetching now if they're missing or too old)
+    if st.session_state.gemini_api_key and not st.session_state.events_checked:
+        st.session_state.events_checked = True
+        with st.spinner("Checking events..."):
+            swr = agent_logic.get_events_swr(
+                config.LOCATION_NAME,
+                st.session_state.gemini_api_key,
+                num_events=5
+            )
+        if not swr.get("success"):
+            st.caption(f"Event refresh failed: {swr.get('error', 'Unknown error')}")
     
-    # Load current events count
+    # Loaded once per rerun and shared with the banner and Events tab
     events_data = agent_logic.load_events_from_file()
+    st.caption(f"Last updated: {agent_logic.get_events_last_updated(events_data)}")
+    
+    # Current events count
     events_count = len(events_data.get("events", [])) if events_data else 0
     st.write(f"Events loaded: {events_count}")
     
     # Refresh button
     if st.button("Refresh Events", disabled=not st.session_state.gemini_api_key):
         with st.spinner("Fetching real events from web..."):
-            result = agent_logic.fetch_real_events(
+            # An explicit click always refetches, however recent the saved events are
+            result = agent_logic.get_events_swr(
                 config.LOCATION_NAME,
                 st.session_state.gemini_api_key,
-                num_events=5
+                num_events=5,
+                force=True
             )
             
             if result.get("success"):
-                agent_logic.save_events_to_file(result)
                 st.success(f"Found {len(result['events'])} events!")
                 st.rerun()
             else:
@@ -118,21 +155,34 @@ with st.sidebar:
     # --- Self-Test ---
     if st.button("Run Self-Test"):
         st.info("Running diagnostic on 'River Walk'...")
-        evaluator = RouteEvaluator()
+        evaluator = get_evaluator()
         st.write("Diagnostic complete (See Evaluator.py for details)")
 
 # --- Main UI ---
 st.title(f"{config.LOCATION_NAME} Explorer")
 
 # Show events status banner
-events_data = agent_logic.load_events_from_file()
 if not events_data or not events_data.get("events"):
     st.warning("No events loaded. Click 'Refresh Events' in the sidebar to fetch real local events.")
 
-tab1, tab2, tab3, tab4 = st.tabs(["Assistant", "Map", "Events", "Evaluator"])
+# A radio rather than st.tabs: tabs run every body on each rerun, this runs only the visible one
+section = st.radio("Section", ["Assistant", "Map", "Events", "Evaluator"],
+                   horizontal=True, key="active_tab", label_visibility="collapsed")
 
-with tab1:
-    for msg in st.session_state.chat_history:
+def assistant_panel():
+    """
+    Chat and route planning. Not a fragment: a turn updates Gemini usage and
+    saved routes, so the sidebar and Ollama status need the full rerun.
+    """
+    # Only the latest messages render inline; older ones wait behind an expander
+    history = st.session_state.chat_history
+    older, recent = history[:-CHAT_RECENT_MESSAGES], history[-CHAT_RECENT_MESSAGES:]
+    if older:
+        with st.expander(f"{len(older)} earlier messages"):
+            for msg in older:
+                with st.chat_message(msg["role"]):
+                    st.write(msg["content"])
+    for msg in recent:
         with st.chat_message(msg["role"]):
             st.write(msg["content"])
             
@@ -141,134 +191,237 @@ with tab1:
         with st.chat_message("user"): st.write(prompt)
         
         with st.chat_message("assistant"):
-            if not ollama_ok:
+            # With a Gemini key, one Gemini call writes the reply and plans the route
+            gemini_chat = bool(st.session_state.gemini_api_key) and agent_logic.gemini_available()
+            if not gemini_chat and not ollama_ok:
                 st.error("Please start Ollama!")
             else:
-                # 1. Ollama Intent (with real events)
-                with st.spinner("Thinking..."):
-                    resp = agent_logic.query_ollama_with_events(prompt)
-                    route_req = utils.extract_route_request(resp)
-                    
-                    # Display response (without the tags)
-                    clean_resp = resp.replace('[ROUTE_REQUEST]', '').split('[/ROUTE_REQUEST]')[0]
-                    st.write(clean_resp)
+                route_data = None
+                
+                if gemini_chat:
+                    # 1. Gemini reply + route plan (no Ollama round trip)
+                    # The prompt includes the weather, so there is nothing to overlap it with
+                    weather = utils.get_weather_info(config.DEFAULT_LAT, config.DEFAULT_LON)
+                    if agent_logic.GEMINI_STREAM:
+                        # Stream the reply; the route JSON after it is parsed at the end
+                        chunks = []
+                        st.write_stream(utils.visible_stream(
+                            agent_logic.stream_gemini_chat(
+                                prompt,
+                                [config.DEFAULT_LAT, config.DEFAULT_LON],
+                                st.session_state.gemini_api_key,
+                                weather
+                            ), chunks
+                        ))
+                        reply, route_data = agent_logic.route_from_chat_reply(
+                            "".join(chunks), weather, st.session_state.ors_api_key
+                        )
+                    else:
+                        with st.status("Thinking...") as status:
+                            reply, route_data = agent_logic.gemini_chat_route(
+                                prompt,
+                                [config.DEFAULT_LAT, config.DEFAULT_LON],
+                                st.session_state.gemini_api_key,
+                                st.session_state.ors_api_key,
+                                weather=weather
+                            )
+                            status.update(label="Reply and route ready" if route_data else "Reply ready", state="complete")
+                        st.write("".join(utils.visible_stream([reply or ""], [])))
+                    resp = reply or "No response received"
+                else:
+                    # Weather doesn't depend on the reply, so fetch it while Ollama runs
+                    weather_fut = get_executor().submit(
+                        utils.get_weather_info, config.DEFAULT_LAT, config.DEFAULT_LON
+                    )
                     
-                    # Debug: Show extraction status (only if debug mode)
+                    # 1. Ollama Intent (with real events)
+                    # Stream the response as it arrives (without the tags)
+                    chunks = []
+                    st.write_stream(utils.visible_stream(
+                        agent_logic.stream_ollama(prompt, include_events=True), chunks
+                    ))
+                    resp = "".join(chunks) or "No response received"
+                route_req = utils.extract_route_request(resp)
+                
+                # Debug: Show extraction status (only if debug mode)
+                if st.session_state.debug_mode:
+                    with st.expander("Debug: Route Extraction"):
+                        if route_req:
+                            st.success(f"Route request found: {route_req}")
+                        else:
+                            st.warning("No [ROUTE_REQUEST] tags found in response")
+                            st.text("Raw response (last 500 chars):")
+                            st.code(resp[-500:] if len(resp) > 500 else resp)
+                
+                # 2. Gemini Route Generation
+                if route_req and st.session_state.gemini_api_key and not gemini_chat:
+                    # The reply is already on screen; the status line tracks the route
+                    with st.status("Planning route...") as status:
+                        route_data = agent_logic.generate_gemini_route(
+                            route_req, 
+                            [config.DEFAULT_LAT, config.DEFAULT_LON], 
+                            st.session_state.gemini_api_key,
+                            st.session_state.ors_api_key,
+                            weather=weather_fut.result()
+                        )
+                        if route_data:
+                            status.update(label=f"Route planned ({route_data.get('route_type', 'unknown')})", state="complete")
+                        else:
+                            status.update(label="Route planning failed", state="error")
+                        
+                if route_data:
+                    # Debug: Show route data (only if debug mode)
                     if st.session_state.debug_mode:
-                        with st.expander("Debug: Route Extraction"):
-                            if route_req:
-                                st.success(f"Route request found: {route_req}")
-                            else:
-                                st.warning("No [ROUTE_REQUEST] tags found in response")
-                                st.text("Raw response (last 500 chars):")
-                                st.code(resp[-500:] if len(resp) > 500 else resp)
+                        with st.expander("Debug: Gemini Route Data"):
+                            st.write(f"Route type: {route_data.get('route_type', 'unknown')}")
+                            st.write(f"Waypoints count: {len(route_data.get('waypoints', []))}")
+                            if route_data.get('real_distance'):
+                                st.write(f"Real distance: {route_data['real_distance']}")
+                                st.write(f"Real duration: {route_data['real_duration']}")
+                            st.write(f"First 3 waypoints: {route_data.get('waypoints', [])[:3]}")
                     
-                    # 2. Gemini Route Generation
-                    if route_req and st.session_state.gemini_api_key:
-                        with st.spinner("Planning route..."):
-                            route_data = agent_logic.generate_gemini_route(
-                                route_req, 
-                                [config.DEFAULT_LAT, config.DEFAULT_LON], 
-                                st.session_state.gemini_api_key,
-                                st.session_state.ors_api_key
-                            )
-                            
-                            if route_data:
-                                # Debug: Show route data (only if debug mode)
-                                if st.session_state.debug_mode:
-                                    with st.expander("Debug: Gemini Route Data"):
-                                        st.write(f"Route type: {route_data.get('route_type', 'unknown')}")
-                                        st.write(f"Waypoints count: {len(route_data.get('waypoints', []))}")
-                                        if route_data.get('real_distance'):
-                                            st.write(f"Real distance: {route_data['real_distance']}")
-                                            st.write(f"Real duration: {route_data['real_duration']}")
-                                        st.write(f"First 3 waypoints: {route_data.get('waypoints', [])[:3]}")
-                                
-                                # 3. Self-Testing/Scoring
-                                evaluator = RouteEvaluator()
-                                score, report = evaluator.score_route(route_data)
-                                
-                                # Store evaluation for Evaluator tab
-                                st.session_state.last_evaluation = report
-                                st.session_state.last_route_data = route_data
-                                
-                                # Display simple score with link to Evaluator tab
-                                if score >= 80:
-                                    st.success(f"Route Quality: {score}/100 - {report['summary']}")
-                                elif score >= 60:
-                                    st.info(f"Route Quality: {score}/100 - {report['summary']}")
-                                elif score >= 40:
-                                    st.warning(f"Route Quality: {score}/100 - {report['summary']}")
-                                else:
-                                    st.error(f"Route Quality: {score}/100 - {report['summary']}")
-                                
-                                st.caption("See Evaluator tab for detailed report")
-                                    
-                                # Save route
-                                st.session_state.routes.append(route_data['waypoints'])
-                                st.session_state.map_center = route_data['waypoints'][0]
-                                st.success("Route added to map!")
+                    # 3. Self-Testing/Scoring
+                    evaluator = get_evaluator()
+                    score, report = evaluator.score_route(route_data)
                     
-                    # Save assistant response
-                    st.session_state.chat_history.append({"role": "assistant", "content": resp})
+                    # Store evaluation for Evaluator tab
+                    st.session_state.last_evaluation = report
+                    st.session_state.last_route_data = route_data
+                    
+                    # Display simple score with link to Evaluator tab
+                    if score >= 80:
+                        st.success(f"Route Quality: {score}/100 - {report['summary']}")
+                    elif score >= 60:
+                        st.info(f"Route Quality: {score}/100 - {report['summary']}")
+                    elif score >= 40:
+                        st.warning(f"Route Quality: {score}/100 - {report['summary']}")
+                    else:
+                        st.error(f"Route Quality: {score}/100 - {report['summary']}")
+                    
+                    st.caption("See Evaluator tab for detailed report")
+                        
+                    # Save route (only its numeric points can go on the map)
+                    points = agent_logic.valid_waypoints(route_data.get('waypoints') or [])
+                    if points:
+                        st.session_state.route_coords = np.vstack([
+                            st.session_state.route_coords,
+                            np.asarray(points, dtype=np.float32)
+                        ])
+                        st.session_state.route_offsets.append(len(st.session_state.route_coords))
+                        st.session_state.map_center = points[0]
+                        st.success("Route added to map!")
+        
+                # Save assistant response
+                st.session_state.chat_history.append({"role": "assistant", "content": resp})
+
+if section == "Assistant":
+    assistant_panel()
+
+def add_route_to_map(m, route_id, route):
+    """Draw one route's line and start/end markers as a single layer"""
+    import folium
+    if len(route) > 0:
+        points = route.tolist()  # Folium wants plain lists
+        fg = folium.FeatureGroup(name=f"Route {route_id + 1}")
+        folium.PolyLine(points, weight=5, color='blue').add_to(fg)
+        folium.Marker(points[0], icon=folium.Icon(color='green', icon='play')).add_to(fg)
+        folium.Marker(points[-1], icon=folium.Icon(color='red', icon='stop')).add_to(fg)
+        fg.add_to(m)
 
-with tab2:
-    m = folium.Map(location=st.session_state.map_center, zoom_start=14)
+def new_map(center, markers):
+    """Base map with the event markers"""
+    import folium  # Only needed when the map is (re)built
+    from folium.plugins import MarkerCluster
+    m = folium.Map(location=list(center), zoom_start=14)
     
-    # Add event markers
+    # Event markers as one clustered layer, so overlapping venues draw as one
+    fg = MarkerCluster(name="Events")
+    for lat, lon, name, when in markers:
+        folium.Marker(
+            [lat, lon],
+            popup=f"{name}<br>{when}",
+            tooltip=name,
+            icon=folium.Icon(color='purple', icon='star')
+        ).add_to(fg)
+    fg.add_to(m)
+    return m
+
+def get_map_html(center, markers):
+    """
+    Map HTML kept in session state. Routes are only ever appended, so only
+    routes not drawn yet get new layers; the map is rebuilt only when the
+    event markers change or the route list shrinks.
+    """
+    ss = st.session_state
+    offsets = ss.route_offsets
+    count = len(offsets) - 1
+    drawn = ss.get("map_route_count", 0)
+    if ss.get("map_markers") != markers or count < drawn:
+        ss.map_obj = new_map(center, markers)
+        ss.map_markers = markers
+        ss.map_html = None
+        drawn = 0
+    if ss.map_obj.location != list(center):
+        ss.map_obj.location = list(center)  # Only read when the HTML is rendered
+        ss.map_html = None
+    if count > drawn or ss.map_html is None:
+        for i in range(drawn, count):
+            add_route_to_map(ss.map_obj, i, ss.route_coords[offsets[i]:offsets[i + 1]])
+        ss.map_route_count = count
+        ss.map_html = ss.map_obj.get_root().render()
+    return ss.map_html
+
+@st.fragment
+def render_map_tab():
     events_data = agent_logic.load_events_from_file()
-    if events_data and events_data.get("events"):
-        for evt in events_data["events"]:
-            if evt.get("geocoded") and evt.get("lat") and evt.get("lon"):
-                folium.Marker(
-                    [evt["lat"], evt["lon"]],
-                    popup=f"{evt.get('name', 'Event')}<br>{evt.get('date', '')} {evt.get('time', '')}",
-                    tooltip=evt.get('name', 'Event'),
-                    icon=folium.Icon(color='purple', icon='star')
-                ).add_to(m)
-    
-    # Add routes
-    for route in st.session_state.routes:
-        if len(route) > 0:
-            folium.PolyLine(route, weight=5, color='blue').add_to(m)
-            folium.Marker(route[0], icon=folium.Icon(color='green', icon='play')).add_to(m)
-            folium.Marker(route[-1], icon=folium.Icon(color='red', icon='stop')).add_to(m)
-            
-    st_folium(m, height=600, width=None)
+    markers = tuple(
+        (evt["lat"], evt["lon"], evt.get('name', 'Event'), f"{evt.get('date', '')} {evt.get('time', '')}")
+        for evt in (events_data or {}).get("events") or []
+        if evt.get("geocoded") and evt.get("lat") and evt.get("lon")
+    )
+    html = get_map_html(st.session_state.map_center, markers)
+    components.html(html, height=600)
 
-with tab3:
+if section == "Map":
+    render_map_tab()
+
+if section == "Events":
     st.subheader("Loaded Events")
     
-    events_data = agent_logic.load_events_from_file()
-    
     if events_data and events_data.get("events"):
-        st.caption(f"Last updated: {agent_logic.get_events_last_updated()}")
+        st.caption(f"Last updated: {agent_logic.get_events_last_updated(events_data)}")
         st.caption(f"Location: {events_data.get('location', 'Unknown')}")
         
         for i, event in enumerate(events_data["events"], 1):
             with st.expander(f"{i}. {event.get('name', 'Unnamed Event')}", expanded=(i == 1)):
+                # One markdown element per block instead of one per field
                 col1, col2 = st.columns(2)
                 with col1:
-                    st.write(f"**Location:** {event.get('location', 'TBD')}")
-                    st.write(f"**Date:** {event.get('date', 'TBD')}")
-                    st.write(f"**Time:** {event.get('time', 'TBD')}")
+                    st.markdown(
+                        f"**Location:** {event.get('location', 'TBD')}\n\n"
+                        f"**Date:** {event.get('date', 'TBD')}\n\n"
+                        f"**Time:** {event.get('time', 'TBD')}"
+                    )
                 with col2:
-                    st.write(f"**Category:** {event.get('category', 'other')}")
-                    st.write(f"**Cost:** {event.get('cost', 'Unknown')}")
                     # Show geocoding status
                     if event.get('geocoded'):
-                        st.write(f"**Coords:** {event.get('lat', 0):.4f}, {event.get('lon', 0):.4f}")
+                        coords = f"{event.get('lat', 0):.4f}, {event.get('lon', 0):.4f}"
                     else:
-                        st.write(f"**Coords:** Not found")
-                
-                st.write(f"**Details:** {event.get('description', 'No description available')}")
+                        coords = "Not found"
+                    st.markdown(
+                        f"**Category:** {event.get('category', 'other')}\n\n"
+                        f"**Cost:** {event.get('cost', 'Unknown')}\n\n"
+                        f"**Coords:** {coords}"
+                    )
                 
+                details = f"**Details:** {event.get('description', 'No description available')}"
                 if event.get('source_url'):
-                    st.markdown(f"[Source]({event['source_url']})")
+                    details += f"\n\n[Source]({event['source_url']})"
+                st.markdown(details)
     else:
         st.info("No events loaded yet. Click 'Refresh Events' in the sidebar to fetch real local events.")
 
-with tab4:
+if section == "Evaluator":
     st.subheader("Route Quality Evaluator")
     
     if st.session_state.last_evaluation:
@@ -322,8 +475,7 @@ with tab4:
             
             # Details
             with st.expander(f"Details for {check['name']}"):
-                for detail in check['details']:
-                    st.text(detail)
+                st.text("\n".join(check['details']))
                 if check.get('warnings'):
                     st.text("")
                     st.text("Warnings:")
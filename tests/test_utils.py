@@ -0,0 +1,24 @@
+import pytest
+
+pytest.importorskip("streamlit")
+
+import utils
+
+
+def test_extract_route_request_basic():
+    text = "Sure!\n[ROUTE_REQUEST]\ndestination: Court Street\ntype: walk/run\n[/ROUTE_REQUEST]"
+    assert utils.extract_route_request(text) == {"destination": "Court Street", "type": "walk"}
+
+
+def test_extract_route_request_empty_value_keeps_next_key():
+    text = "[ROUTE_REQUEST]\ndistance:\ntype: walk\n[/ROUTE_REQUEST]"
+    assert utils.extract_route_request(text) == {"distance": "", "type": "walk"}
+
+
+def test_extract_route_request_unclosed_tag():
+    text = "[ROUTE_REQUEST]\ndestination: Baker Center\n\nEnjoy!"
+    assert utils.extract_route_request(text) == {"destination": "Baker Center"}
+
+
+def test_extract_route_request_without_tag():
+    assert utils.extract_route_request("No route here") is None
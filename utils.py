@@ -1,90 +1,351 @@
 # utils.py
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import logging
+import atexit
 import re
+import io
+import mmap
 import json
+import hashlib
+import os
+import sqlite3
+import threading
+from contextlib import closing, contextmanager
+import time
+import numpy as np
 import streamlit as st
 from datetime import datetime, date
+from pathlib import Path
+from types import MappingProxyType
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+try:
+    import fcntl  # POSIX only; elsewhere the usage file is guarded per process
+except ImportError:
+    fcntl = None
+
+try:
+    import ijson
+    IJSON_AVAILABLE = True
+except ImportError:
+    IJSON_AVAILABLE = False
+
+# --- JSON (orjson when installed, stdlib json otherwise) ---
+
+# For pulling the first complete JSON value out of surrounding prose
+_JSON_DECODER = json.JSONDecoder()
+
+def json_loads(data):
+    """Parse JSON from str or bytes"""
+    if ORJSON_AVAILABLE:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def load_json_file(path):
+    """Parse a JSON file, straight off a read-only memory map when orjson is available"""
+    if ORJSON_AVAILABLE:
+        try:
+            with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                with memoryview(mm) as view:
+                    return orjson.loads(view)
+        except ValueError as e:
+            if isinstance(e, orjson.JSONDecodeError):
+                raise
+            # Empty files can't be mapped; fall through to a plain read
+    with open(path, 'rb') as f:
+        return json_loads(f.read())
+
+def json_dumps_bytes(obj, indent=False):
+    """Serialize to UTF-8 JSON bytes: compact by default, or with 2-space indent"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+    if indent:
+        return json.dumps(obj, indent=2, ensure_ascii=False).encode("utf-8")
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+@st.cache_resource(show_spinner=False)
+def get_http_session():
+    """
+    Keep-alive pool for Ollama (localhost) and Open-Meteo, shared across reruns
+    and sessions so repeat calls skip the TCP (and TLS) handshake
+    """
+    s = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=20, max_retries=1)
+    s.mount("http://", adapter)
+    s.mount("https://", adapter)
+    s.headers["Connection"] = "keep-alive"
+    atexit.register(s.close)
+    return s
+
+_ROUTE_RE = re.compile(r'\[ROUTE_REQUEST\](.*?)\[/ROUTE_REQUEST\]', re.DOTALL)
+_ROUTE_UNCLOSED_RE = re.compile(r'\[ROUTE_REQUEST\](.*?)(?=\n\n|\Z)', re.DOTALL)
+# One line's "key: value", split at the first colon; never reaches into the next line
+_KV_RE = re.compile(r'^([^:\n]*):(.*)$', re.MULTILINE)
 
 def extract_route_request(text):
     """Extract route request details from Ollama response"""
-    # Try standard format first
-    pattern = r'\[ROUTE_REQUEST\](.*?)\[/ROUTE_REQUEST\]'
-    match = re.search(pattern, text, re.DOTALL)
-    
-    # If no match, try to find unclosed tag
-    if not match:
-        pattern_unclosed = r'\[ROUTE_REQUEST\](.*?)(?=\n\n|\Z)'
-        match = re.search(pattern_unclosed, text, re.DOTALL)
+    # Try standard format first, then an unclosed tag
+    match = _ROUTE_RE.search(text) or _ROUTE_UNCLOSED_RE.search(text)
     
     if match:
-        content = match.group(1)
         request = {}
-        for line in content.split('\n'):
-            if ':' in line:
-                # Handle "type: walk/run" -> take first option
-                key, value = line.split(':', 1)
-                key = key.strip().lower()
-                value = value.strip()
-                
-                # Take first option if multiple given (e.g., "walk/run" -> "walk")
-                if '/' in value and key in ['type']:
-                    value = value.split('/')[0]
-                
-                request[key] = value
+        for key, value in _KV_RE.findall(match.group(1)):
+            key = key.strip().lower()
+            value = value.strip()
+            
+            # Take first option if multiple given (e.g., "walk/run" -> "walk")
+            if '/' in value and key == 'type':
+                value = value.split('/')[0]
+            
+            request[key] = value
         return request if request else None
     return None
 
+def parse_event_list(text, limit=None):
+    """Extract the events JSON array from a Gemini response, keeping at most `limit` events"""
+    start = text.find('[')
+    
+    # Stream items off the first array and stop once we have enough
+    if IJSON_AVAILABLE and start != -1:
+        events = []
+        try:
+            for item in ijson.items(io.BytesIO(text[start:].encode()), 'item', use_float=True):
+                events.append(item)
+                if limit and len(events) >= limit:
+                    break
+        except ijson.JSONError:
+            pass  # Trailing prose after the array
+        if events:
+            return events
+    
+    # Otherwise decode the first complete array, then the {"events": [...]} form
+    for opener in ('[', '{'):
+        start = text.find(opener)
+        if start == -1:
+            continue
+        try:
+            data, _ = _JSON_DECODER.raw_decode(text, start)
+        except ValueError:
+            continue
+        return (data if opener == '[' else data.get('events', []))[:limit]
+    return []
+
+def visible_stream(tokens, chunks):
+    """
+    Pass streamed tokens through for display, hiding [ROUTE_REQUEST] tags.
+    Every raw token is appended to `chunks` so the caller can rebuild the full text.
+    Shows the same text as resp.replace('[ROUTE_REQUEST]', '').split('[/ROUTE_REQUEST]')[0]
+    """
+    tags = ('[ROUTE_REQUEST]', '[/ROUTE_REQUEST]')
+    pending = ""
+    closed = False
+    for token in tokens:
+        chunks.append(token)
+        if closed:
+            continue
+        # pending only ever holds a partial tag, so this stays O(len(token))
+        pending = (pending + token).replace(tags[0], '')
+        if tags[1] in pending:
+            closed = True
+            yield pending.split(tags[1])[0]
+            continue
+        # Hold back a tag that may still be arriving
+        tail = pending.rfind('[')
+        if tail != -1 and any(tag.startswith(pending[tail:]) for tag in tags):
+            out, pending = pending[:tail], pending[tail:]
+        else:
+            out, pending = pending, ""
+        if out:
+            yield out
+    if pending and not closed:
+        yield pending
+
+# --- Weather (Open-Meteo - FREE) ---
+
+WEATHER_URL = "https://api.open-meteo.com/v1/forecast"
+WEATHER_PARAMS = {"current": "temperature_2m,weathercode,windspeed_10m", "temperature_unit": "fahrenheit"}
+# Full WMO weather interpretation table as used by Open-Meteo (read-only)
+WEATHER_CODES = MappingProxyType({
+    0: "Clear", 1: "Mainly Clear", 2: "Partly Cloudy", 3: "Overcast",
+    45: "Fog", 48: "Freezing Fog",
+    51: "Light Drizzle", 53: "Drizzle", 55: "Dense Drizzle",
+    56: "Light Freezing Drizzle", 57: "Freezing Drizzle",
+    61: "Rain", 63: "Moderate Rain", 65: "Heavy Rain",
+    66: "Light Freezing Rain", 67: "Freezing Rain",
+    71: "Snow", 73: "Moderate Snow", 75: "Heavy Snow", 77: "Snow Grains",
+    80: "Rain Showers", 81: "Moderate Rain Showers", 82: "Violent Rain Showers",
+    85: "Snow Showers", 86: "Heavy Snow Showers",
+    95: "Thunderstorm", 96: "Thunderstorm with Hail", 99: "Thunderstorm with Heavy Hail",
+})
+
+@st.cache_data(ttl=600, show_spinner=False)
+def _fetch_weather(lat, lon):
+    """Open-Meteo lookup, cached for 10 minutes per location; raises on failure so errors aren't cached"""
+    response = get_http_session().get(WEATHER_URL, params={"latitude": lat, "longitude": lon, **WEATHER_PARAMS}, timeout=(1, 3))
+    response.raise_for_status()
+    data = response.json()
+    
+    current = data.get('current', {})
+    condition = WEATHER_CODES.get(current.get('weathercode', 0), "Unknown")
+    
+    return {
+        "temperature": f"{current.get('temperature_2m', 'N/A')}°F",
+        "condition": condition,
+        "wind_speed": f"{current.get('windspeed_10m', 'N/A')} mph"
+    }
+
 def get_weather_info(lat, lon):
-    """Get current weather information"""
+    """Get current weather information; a failed lookup is retried on the next call"""
     try:
-        url = f"https://api.open-meteo.com/v1/forecast?latitude={lat}&longitude={lon}&current=temperature_2m,weathercode,windspeed_10m&temperature_unit=fahrenheit"
-        response = requests.get(url, timeout=5)
-        data = response.json()
-        
-        current = data.get('current', {})
-        weather_codes = {0: "Clear", 1: "Mainly Clear", 2: "Partly Cloudy", 3: "Overcast", 61: "Rain", 71: "Snow"}
-        condition = weather_codes.get(current.get('weathercode', 0), "Unknown")
-        
-        return {
-            "temperature": f"{current.get('temperature_2m', 'N/A')}°F",
-            "condition": condition,
-            "wind_speed": f"{current.get('windspeed_10m', 'N/A')} mph"
-        }
-    except:
+        return _fetch_weather(lat, lon)
+    except Exception:
         return {"temperature": "N/A", "condition": "Unable to fetch", "wind_speed": "N/A"}
 
 # --- Geocoding (Nominatim - FREE) ---
 
-def geocode_location(address, city="Athens, Ohio"):
-    """Convert address to lat/lon using OpenStreetMap Nominatim (FREE)"""
-    try:
-        # Add city context for better results
-        full_address = f"{address}, {city}" if city.lower() not in address.lower() else address
-        
-        url = "https://nominatim.openstreetmap.org/search"
-        params = {
-            "q": full_address,
-            "format": "json",
-            "limit": 1
-        }
-        headers = {
-            "User-Agent": "TG-Agent-Student-Project/1.0"  # Required by Nominatim
+NOMINATIM_URL = "https://nominatim.openstreetmap.org/search"
+NOMINATIM_HEADERS = {
+    "User-Agent": "TG-Agent-Student-Project/1.0"  # Required by Nominatim
+}
+
+def _nominatim_params(address, city):
+    """Build Nominatim query params, adding city context for better results"""
+    full_address = f"{address}, {city}" if city.lower() not in address.lower() else address
+    return {
+        "q": full_address,
+        "format": "json",
+        "limit": 1
+    }
+
+def _parse_nominatim(data, address):
+    """Pick the top Nominatim hit, or None"""
+    if data:
+        return {
+            "lat": float(data[0]["lat"]),
+            "lon": float(data[0]["lon"]),
+            "display_name": data[0].get("display_name", address)
         }
-        
-        response = requests.get(url, params=params, headers=headers, timeout=10)
-        data = response.json()
-        
-        if data:
-            return {
-                "lat": float(data[0]["lat"]),
-                "lon": float(data[0]["lon"]),
-                "display_name": data[0].get("display_name", address)
-            }
+    return None
+
+# Successful lookups persist across refreshes and restarts (venues repeat a lot)
+GEOCODE_CACHE_FILE = Path(".cache/geocode.sqlite")
+GEOCODE_CACHE_TTL = 30 * 86400  # seconds
+GEOCODE_MEMO_SIZE = 512
+_geo_memo = {}  # Insertion-ordered, oldest dropped first
+_ADDRESS_PUNCT_RE = re.compile(r"[^\w\s]+")
+
+def _normalize_address(text):
+    """Lowercase, drop punctuation and collapse whitespace, so near-identical venue strings share a key"""
+    return " ".join(_ADDRESS_PUNCT_RE.sub(" ", text.lower()).split())
+
+def _geocode_key(address, city):
+    return (_normalize_address(address), _normalize_address(city))
+
+def _remember_geocode(key, coords):
+    _geo_memo[key] = coords
+    if len(_geo_memo) > GEOCODE_MEMO_SIZE:
+        _geo_memo.pop(next(iter(_geo_memo)), None)
+
+def _geocode_db():
+    GEOCODE_CACHE_FILE.parent.mkdir(exist_ok=True)
+    conn = sqlite3.connect(GEOCODE_CACHE_FILE)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS geocode "
+        "(address TEXT, city TEXT, coords TEXT, stored REAL, PRIMARY KEY (address, city))"
+    )
+    return conn
+
+def get_cached_geocode(address, city="Athens, Ohio"):
+    """Look up a previous geocode result (memory first, then disk), or None"""
+    key = _geocode_key(address, city)
+    if key in _geo_memo:
+        return _geo_memo[key]
+    try:
+        with closing(_geocode_db()) as conn, conn:
+            row = conn.execute(
+                "SELECT coords, stored FROM geocode WHERE address = ? AND city = ?", key
+            ).fetchone()
+    except sqlite3.Error as e:
+        logger.warning("Geocode cache error: %s", e)
         return None
+    if row and time.time() - row[1] < GEOCODE_CACHE_TTL:
+        coords = json.loads(row[0])
+        _remember_geocode(key, coords)
+        return coords
+    return None
+
+def set_cached_geocode(address, city, coords):
+    """Remember a successful geocode result"""
+    key = _geocode_key(address, city)
+    _remember_geocode(key, coords)
+    try:
+        with closing(_geocode_db()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO geocode VALUES (?, ?, ?, ?)",
+                (*key, json.dumps(coords), time.time())
+            )
+    except sqlite3.Error as e:
+        logger.warning("Geocode cache error: %s", e)
+
+async def geocode_location_async(session, address, city="Athens, Ohio"):
+    """Async geocode over a shared aiohttp session (caller handles rate limiting)"""
+    try:
+        params = _nominatim_params(address, city)
+        async with session.get(NOMINATIM_URL, params=params) as response:
+            data = await response.json(content_type=None)
+        return _parse_nominatim(data, address)
     except Exception as e:
-        print(f"Geocoding error for '{address}': {str(e)}")
+        logger.warning("Geocoding error for %r: %s", address, e)
         return None
 
+# --- Routing (OpenRouteService - FREE) ---
+
+# Directions POSTs are idempotent, so transient gateway errors are retried with backoff
+_ors = requests.Session()
+_ors.mount("https://", HTTPAdapter(max_retries=Retry(
+    total=3, backoff_factor=0.3, status_forcelist=(502, 503, 504), allowed_methods=frozenset({"POST"})
+)))
+
+# ~10 m; ORS geometry is far denser than the map or the evaluator needs
+ROUTE_SIMPLIFY_DEG = 1e-4
+
+def simplify_polyline(coords, tolerance=ROUTE_SIMPLIFY_DEG):
+    """Douglas-Peucker on [lat, lon] points: drop vertices within `tolerance` degrees of the simplified line"""
+    pts = np.asarray(coords, dtype=np.float64)
+    n = len(pts)
+    if n < 3:
+        return pts.tolist()
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        i, j = stack.pop()
+        if j - i < 2:
+            continue
+        a, d = pts[i], pts[j] - pts[i]
+        rel = pts[i + 1:j] - a
+        norm = np.hypot(d[0], d[1])
+        if norm > 0:
+            dist = np.abs(d[0] * rel[:, 1] - d[1] * rel[:, 0]) / norm  # Distance to the chord
+        else:
+            dist = np.hypot(rel[:, 0], rel[:, 1])  # Closed loop: distance to the endpoint
+        k = int(dist.argmax())
+        if dist[k] > tolerance:
+            m = i + 1 + k
+            keep[m] = True
+            stack.append((i, m))
+            stack.append((m, j))
+    return pts[keep].tolist()
+
 def get_walking_route(coordinates, ors_api_key):
     """
     Get real walking route along roads using OpenRouteService (FREE - 2000/day)
@@ -103,15 +364,20 @@ def get_walking_route(coordinates, ors_api_key):
             "coordinates": coordinates  # [[lon, lat], [lon, lat], ...]
         }
         
-        response = requests.post(url, json=body, headers=headers, timeout=15)
+        response = _ors.post(url, json=body, headers=headers, timeout=15)
         data = response.json()
         
         if "features" in data and len(data["features"]) > 0:
             geometry = data["features"][0]["geometry"]["coordinates"]
             properties = data["features"][0]["properties"]
             
-            # Convert [lon, lat] to [lat, lon] for Folium
-            route_coords = [[coord[1], coord[0]] for coord in geometry]
+            geometry = np.asarray(geometry, dtype=np.float64)
+            if geometry.ndim != 2 or geometry.shape[1] < 2:
+                logger.warning("ORS returned no route geometry: %s", data["features"][0]["geometry"])
+                return None
+            
+            # Convert [lon, lat] to [lat, lon] for Folium (one column swap)
+            route_coords = simplify_polyline(geometry[:, 1::-1])
             
             # Extract summary
             summary = properties.get("summary", {})
@@ -124,58 +390,130 @@ def get_walking_route(coordinates, ors_api_key):
                 "duration_minutes": round(duration_min, 1)
             }
         else:
-            print(f"ORS Error: {data}")
+            logger.warning("ORS Error: %s", data)
             return None
-    except Exception as e:
-        print(f"Routing error: {str(e)}")
+    except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+        logger.warning("Routing error: %s", e)
         return None
 
+# --- Route Cache (generated routes on disk, survives restarts) ---
+
+ROUTE_CACHE_DIR = Path(".cache/routes")
+
+def route_cache_key(route_req, origin, extra):
+    """SHA-256 over a route request, its start point and whatever else the reply depends on"""
+    blob = json.dumps({"request": route_req, "origin": list(origin), "extra": extra}, sort_keys=True, default=str)
+    return hashlib.sha256(blob.encode()).hexdigest()
+
+def get_cached_route(key):
+    """Previously generated route for this key, or None"""
+    try:
+        return load_json_file(ROUTE_CACHE_DIR / f"{key}.json")
+    except (OSError, ValueError):
+        return None
+
+def set_cached_route(key, route_data):
+    """Store a generated route; best-effort, failures are only logged"""
+    try:
+        ROUTE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        path = ROUTE_CACHE_DIR / f"{key}.json"
+        tmp = path.with_suffix(".tmp")
+        tmp.write_bytes(json_dumps_bytes(route_data))
+        os.replace(tmp, path)  # Atomic, readers never see a partial file
+    except (OSError, TypeError) as e:
+        logger.warning("Route cache write failed: %s", e)
+
 # --- Gemini Usage Tracking ---
 
+# Counters live on disk so the daily quota survives tab reloads and is shared
+# by every session and process; session_state only mirrors the last value
+USAGE_FILE = Path(".cache/gemini_usage.json")
+_usage_memo = {"mtime": None, "data": None}
+_usage_lock = threading.Lock()
+
+def _new_usage():
+    return {
+        "requests_today": 0,
+        "tokens_today": 0,
+        "last_reset": date.today().isoformat(),
+        "last_request_tokens": 0
+    }
+
+def _load_usage():
+    """Today's counters, re-read only when USAGE_FILE changes; fresh ones on a new day"""
+    try:
+        mtime = USAGE_FILE.stat().st_mtime_ns
+        if _usage_memo["mtime"] != mtime:
+            _usage_memo.update(mtime=mtime, data=load_json_file(USAGE_FILE))
+        usage = dict(_usage_memo["data"])
+    except (OSError, ValueError, TypeError):
+        usage = _new_usage()
+    if usage.get("last_reset") != date.today().isoformat():
+        usage = _new_usage()
+    return usage
+
+def _save_usage(usage):
+    try:
+        USAGE_FILE.parent.mkdir(exist_ok=True)
+        tmp = USAGE_FILE.with_suffix(".tmp")
+        tmp.write_bytes(json_dumps_bytes(usage))
+        os.replace(tmp, USAGE_FILE)  # Atomic, readers never see a partial file
+    except OSError as e:
+        logger.warning("Usage file write failed: %s", e)
+
+@contextmanager
+def _locked_usage():
+    """Serialize read-modify-write of USAGE_FILE across threads and, with fcntl, processes"""
+    with _usage_lock:
+        if fcntl is None:
+            yield
+            return
+        USAGE_FILE.parent.mkdir(exist_ok=True)
+        with open(USAGE_FILE.with_suffix(".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+def _mirror_usage(usage):
+    try:
+        st.session_state.gemini_usage = usage
+    except Exception:
+        pass  # No session (e.g. a background thread without a script context)
+
 def init_gemini_usage():
-    """Initialize Gemini usage tracking in session state"""
-    if "gemini_usage" not in st.session_state:
-        st.session_state.gemini_usage = {
-            "requests_today": 0,
-            "tokens_today": 0,
-            "last_reset": date.today().isoformat(),
-            "last_request_tokens": 0
-        }
+    """Mirror the persisted Gemini usage into session state"""
+    _mirror_usage(_load_usage())
 
 def reset_daily_usage_if_needed():
-    """Reset counters if it's a new day"""
-    init_gemini_usage()
-    usage = st.session_state.gemini_usage
-    
-    today = date.today().isoformat()
-    if usage["last_reset"] != today:
-        usage["requests_today"] = 0
-        usage["tokens_today"] = 0
-        usage["last_reset"] = today
+    """Reset counters if it's a new day (the file catches up on the next tracked request)"""
+    usage = _load_usage()
+    _mirror_usage(usage)
+    return usage
 
 def track_gemini_usage(response):
     """Track token usage from a Gemini response"""
-    reset_daily_usage_if_needed()
-    usage = st.session_state.gemini_usage
-    
-    try:
-        metadata = response.usage_metadata
-        tokens_used = metadata.total_token_count
-        
-        usage["requests_today"] += 1
-        usage["tokens_today"] += tokens_used
-        usage["last_request_tokens"] = tokens_used
-    except AttributeError:
-        # If usage_metadata not available, just count the request
-        usage["requests_today"] += 1
-        usage["last_request_tokens"] = 0
-    
+    with _locked_usage():
+        usage = _load_usage()
+        try:
+            metadata = response.usage_metadata
+            tokens_used = metadata.total_token_count
+            
+            usage["requests_today"] += 1
+            usage["tokens_today"] += tokens_used
+            usage["last_request_tokens"] = tokens_used
+        except AttributeError:
+            # If usage_metadata not available, just count the request
+            usage["requests_today"] += 1
+            usage["last_request_tokens"] = 0
+        _save_usage(usage)
+    _mirror_usage(usage)
     return usage
 
 def get_usage_stats():
     """Get current Gemini usage statistics"""
-    reset_daily_usage_if_needed()
-    usage = st.session_state.gemini_usage
+    usage = reset_daily_usage_if_needed()
     
     return {
         "requests_today": usage["requests_today"],
@@ -185,4 +523,4 @@ def get_usage_stats():
         "last_request_tokens": usage["last_request_tokens"],
         "requests_remaining": 1500 - usage["requests_today"],
         "is_warning": usage["requests_today"] > 1400
-    }
\ No newline at end of file
+    }